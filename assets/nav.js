@@ -0,0 +1,60 @@
+// Dropdowns of the header, filtered from the nav-index store without a server round trip.
+// The index holds the countries, leagues and upcoming matches of one data version.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    nav: {
+        lastCountry: null,
+
+        countries: function(index, button) {
+            if (!index) {
+                return window.dash_clientside.no_update;
+            }
+            var countries = index.countries;
+            if (button === 'top') {
+                countries = countries.filter(function(country) {
+                    return index.top.indexOf(country) !== -1;
+                });
+            }
+            return countries.map(function(country) {
+                return {label: country.charAt(0).toUpperCase() + country.slice(1), value: country};
+            });
+        },
+
+        leagues: function(index, country, current) {
+            if (!index) {
+                return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+            }
+            var leagues = index.leagues[country] || [];
+            var options = leagues.map(function(league) {
+                return {label: league, value: league};
+            });
+            // a new index keeps the selected league, a new country starts at its first one
+            var sameCountry = country === window.dash_clientside.nav.lastCountry;
+            window.dash_clientside.nav.lastCountry = country;
+            if (sameCountry && leagues.indexOf(current) !== -1) {
+                return [options, window.dash_clientside.no_update];
+            }
+            return [options, leagues.length ? leagues[0] : null];
+        },
+
+        matches: function(index, country, league) {
+            if (!index) {
+                return window.dash_clientside.no_update;
+            }
+            // the index may be older than today, kick-off dates are YYYY-MM-DD
+            var now = new Date();
+            var today = [
+                now.getFullYear(),
+                ('0' + (now.getMonth() + 1)).slice(-2),
+                ('0' + now.getDate()).slice(-2)
+            ].join('-');
+            var matches = (index.matches[country] || {})[league] || [];
+            var options = [{label: 'All matches', value: null}];
+            matches.forEach(function(match) {
+                if (match[0] >= today) {
+                    options.push({label: match[1], value: match[2]});
+                }
+            });
+            return options;
+        }
+    }
+});
@@ -0,0 +1,162 @@
+import os
+import json
+import argparse
+import logging
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+SIDES = np.array(['home', 'draw', 'away'])
+ODDS_COLS = ['home_odds', 'draw_odds', 'away_odds']
+OPEN_ODDS_COLS = ['home_open_odds', 'draw_open_odds', 'away_open_odds']
+NO_BET = -1
+
+SEASON_START_MONTH = 7 # matches from July on belong to the next season
+CHUNKSIZE = 4 # leagues per process pool task
+
+# report levels, the group columns of every level
+LEVELS = {
+    'country': ['country'],
+    'league': ['country', 'league'],
+    'season': ['country', 'league', 'season'],
+}
+
+
+def _prices(df, cols):
+    prices = df[cols].to_numpy(dtype=float)
+    return np.where(prices > 1, prices, np.nan)
+
+
+def shortened(df, threshold=0.1):
+    # back the side whose odds shortened the most against the open odds, by threshold at least
+    with np.errstate(invalid='ignore'):
+        drop = 1 - _prices(df, ODDS_COLS) / _prices(df, OPEN_ODDS_COLS)
+    drop = np.where(np.isnan(drop), -np.inf, drop)
+    side = drop.argmax(axis=1)
+    return np.where(drop.max(axis=1) >= threshold, side, NO_BET)
+
+
+def pinnacle_favourite(df, max_odds=1.8):
+    # back the favourite of pinnacle priced matches when its odds are below max_odds
+    odds = np.nan_to_num(_prices(df, ODDS_COLS), nan=np.inf)
+    side = odds.argmin(axis=1)
+    favourite = odds[np.arange(len(odds)), side]
+    return np.where(df['pinnacle'].to_numpy(dtype=bool) & (favourite < max_odds), side, NO_BET)
+
+
+# rule(df, **params) -> index into SIDES of the side to back in every row, NO_BET to skip it
+RULES = {
+    'shortened': shortened,
+    'pinnacle_favourite': pinnacle_favourite,
+}
+
+# rules offered in the dashboard, id -> (label, rule, params)
+PRESETS = {
+    'shortened-10': ('Shortened by 10%', 'shortened', {'threshold': 0.1}),
+    'shortened-20': ('Shortened by 20%', 'shortened', {'threshold': 0.2}),
+    'pinnacle-fav-1.5': ('Pinnacle favourite under 1.5', 'pinnacle_favourite', {'max_odds': 1.5}),
+    'pinnacle-fav-1.8': ('Pinnacle favourite under 1.8', 'pinnacle_favourite', {'max_odds': 1.8}),
+}
+
+
+def season(match_dt):
+    year = match_dt.dt.year - (match_dt.dt.month < SEASON_START_MONTH)
+    return year.astype(str) + '/' + ((year + 1) % 100).astype(str).str.zfill(2)
+
+
+def bets(df, rule, params):
+    # one unit stake bet per row the rule picks, over the finished matches with a known outcome
+    df = df[df['finished'] & df['match_outcome'].notna()]
+    side = RULES[rule](df, **params)
+    placed = side != NO_BET
+    df, side = df[placed], side[placed]
+    odds = df[ODDS_COLS].to_numpy(dtype=float)[np.arange(len(df)), side]
+    won = SIDES[side] == df['match_outcome'].astype(object).to_numpy()
+    return pd.DataFrame({
+        'match_dt': df['match_dt'].to_numpy(),
+        'country': df['country'].astype(object).to_numpy(),
+        'league': df['league'].astype(object).to_numpy(),
+        'season': season(df['match_dt']).to_numpy(),
+        'match_link': df['match_link'].to_numpy(),
+        'side': SIDES[side],
+        'odds': odds,
+        'won': won,
+        'profit': np.where(won, odds - 1, -1.0),
+    })
+
+
+def run(df, rule, params=None, workers=None):
+    # bets of rule over the whole archive, leagues are spread over a process pool
+    params = params or {}
+    leagues = [league for _, league in df[df['finished']].groupby(['country', 'league'], sort=False, observed=True)]
+    if workers == 1 or len(leagues) < 2:
+        parts = [bets(league, rule, params) for league in leagues]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(bets, leagues, repeat(rule), repeat(params), chunksize=CHUNKSIZE))
+    return pd.concat(parts, ignore_index=True) if parts else bets(df.iloc[:0], rule, params)
+
+
+def max_drawdown(profit):
+    # deepest fall of the running profit below its previous high
+    equity = np.concatenate([[0.0], np.cumsum(profit)])
+    return float((np.maximum.accumulate(equity) - equity).max())
+
+
+def summarize(placed, by):
+    # bets, hit rate, profit, ROI and max drawdown per group, bets taken in kick-off order
+    placed = placed.sort_values('match_dt', kind='mergesort')
+    rows = []
+    for key, group in placed.groupby(by if len(by) > 1 else by[0], sort=True):
+        profit = group['profit'].to_numpy()
+        rows.append({
+            **dict(zip(by, key if len(by) > 1 else (key,))),
+            'bets': len(group),
+            'hit_rate': round(float(group['won'].mean()), 4),
+            'profit': round(float(profit.sum()), 2),
+            'roi': round(float(profit.sum() / len(group)), 4),
+            'max_drawdown': round(max_drawdown(profit), 2),
+        })
+    return pd.DataFrame(rows, columns=by + ['bets', 'hit_rate', 'profit', 'roi', 'max_drawdown'])
+
+
+def report(placed):
+    return {level: summarize(placed, by) for level, by in LEVELS.items()}
+
+
+# Backtests a rule over the whole archive, e.g.
+#   python backtest.py shortened --param threshold=0.15 --level league
+if __name__ == '__main__':
+    from sqlalchemy import create_engine
+
+    import store
+    import snapshots
+
+    parser = argparse.ArgumentParser(description='backtest a betting rule over the finished matches of odds_archive')
+    parser.add_argument('rule', choices=list(RULES))
+    parser.add_argument('--param', action='append', default=[], help='rule parameter as name=value')
+    parser.add_argument('--level', choices=list(LEVELS), default='league')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    logging.basicConfig(
+    filename='./oddstab.log',
+    filemode='a',
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.ERROR)
+
+    cached = snapshots.read()
+    if cached is None:
+        with open('./valid_users.json') as handle:
+            VALID_USERNAME_PASSWORD_PAIRS = json.loads(handle.read())
+        df = store.load(create_engine('postgresql://' + VALID_USERNAME_PASSWORD_PAIRS['postgresql'])).data
+    else:
+        df = cached[0]
+
+    params = {name: float(value) for name, value in (param.split('=', 1) for param in args.param)}
+    summary = summarize(run(df, args.rule, params, args.workers), LEVELS[args.level])
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(summary.to_string(index=False))
@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+import store
+import sql_store
+import snapshots
+import views
+from bench import synthetic
+
+
+# Times the dashboard hot paths against a synthetic odds_archive, e.g.
+#   python -m bench.run --sizes small medium --repeat 50
+#   python -m bench.run --backend sql --json bench_output.json
+PERCENTILES = [50, 90, 99]
+COLUMNS = [f'p{p}_ms' for p in PERCENTILES] + ['calls', 'peak_mb', 'response_kb', 'data_mb']
+SAMPLE = 20 # leagues and matches every view is timed on
+
+
+def measure(fn, calls, repeat, response=True):
+    # latency percentiles of repeat rounds over calls, peak traced memory of one round
+    # and the mean size of the JSON the callbacks would send
+    latencies = []
+    for _ in range(repeat):
+        for args in calls:
+            started = time.perf_counter()
+            fn(*args)
+            latencies.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    outputs = [fn(*args) for args in calls]
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    ms = np.percentile(np.array(latencies) * 1000, PERCENTILES)
+    result = {f'p{p}_ms': round(float(value), 2) for p, value in zip(PERCENTILES, ms)}
+    result.update({'calls': len(latencies), 'peak_mb': round(peak / 2 ** 20, 2)})
+    if response:
+        sizes = [len(json.dumps(output, default=str)) for output in outputs]
+        result['response_kb'] = round(np.mean(sizes) / 1024, 1)
+    return result
+
+
+def sample(rng, values):
+    values = list(values)
+    return [values[ix] for ix in sorted(rng.choice(len(values), size=min(SAMPLE, len(values)), replace=False))]
+
+
+def nav_index():
+    # the index as update_nav_index builds it after a refresh, without the one of the last call
+    views.use(views.STORE)
+    return views.nav_index()
+
+
+def view_calls(rng, backend):
+    # upcoming matches and their leagues, the selections the dashboard is opened with
+    upcoming = store.data()[~store.data()['finished']]
+    leagues = sample(rng, upcoming[['country', 'league']].drop_duplicates().itertuples(index=False))
+    links = sample(rng, upcoming['match_link'])
+    calls = {
+        'league_odds_tab': (views.league_odds_tab, [(c, l, False) for c, l in leagues]),
+        'team_odds_tab': (views.team_odds_tab, [(link, side, False, 0) for link in links for side in ['home', 'away']]),
+        'team_odds_tab[all]': (views.team_odds_tab, [(link, 'home', False, None) for link in links]),
+        'create_h2h_tab': (views.create_h2h_tab, [(link, False, 0) for link in links]),
+        'create_h2h_tab[true_odds]': (views.create_h2h_tab, [(link, True, 0) for link in links]),
+        'update_nav_index': (nav_index, [()]),
+    }
+    if backend == 'sql':
+        # unpaged history needs LIMIT NULL, which SQLite refuses
+        del calls['team_odds_tab[all]']
+    return calls
+
+
+def run_size(size, backend, repeat, workdir):
+    engine = synthetic.create(os.path.join(workdir, f'{size}.sqlite'), size)
+    rows = engine.connect().exec_driver_sql('SELECT count(*) FROM odds_archive').scalar()
+    results = {'full load': measure(store.load, [(engine,)], max(1, repeat // 10), response=False)}
+    results['full load']['data_mb'] = round(store.data().memory_usage(deep=True).sum() / 2 ** 20, 2)
+
+    if backend == 'sql':
+        sql_store.ENGINE = engine
+        views.use(sql_store)
+    else:
+        views.use(store)
+
+    rng = np.random.default_rng(0)
+    for name, (fn, calls) in view_calls(rng, backend).items():
+        results[name] = measure(fn, calls, repeat)
+    return rows, results
+
+
+def report(size, backend, rows, results):
+    print(f'\n{size} archive, {rows} rows, {backend} backend')
+    print(f'{"":<28}' + ''.join(f'{col:>13}' for col in COLUMNS))
+    for name, result in results.items():
+        print(f'{name:<28}' + ''.join(f'{result.get(col, "-"):>13}' for col in COLUMNS))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark the oddstab views on a synthetic archive')
+    parser.add_argument('--sizes', nargs='+', default=['small', 'medium'], choices=list(synthetic.SIZES))
+    parser.add_argument('--backend', default='memory', choices=['memory', 'sql'])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    # the local snapshot cache would turn the timed full loads into disk writes
+    snapshots.SNAPSHOT_PATH = None
+
+    output = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            rows, results = run_size(size, args.backend, args.repeat, workdir)
+            report(size, args.backend, rows, results)
+            output[size] = {'rows': rows, 'backend': args.backend, 'results': results}
+
+    if args.json:
+        with open(args.json, 'w') as handle:
+            json.dump(output, handle, indent=2)
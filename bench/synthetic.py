@@ -0,0 +1,127 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, event
+
+
+# archive sizes of the benchmark, every league plays a double round robin per season
+SIZES = {
+    'small': {'countries': 4, 'leagues': 2, 'teams': 12, 'seasons': 3},
+    'medium': {'countries': 12, 'leagues': 3, 'teams': 18, 'seasons': 6},
+    'large': {'countries': 30, 'leagues': 4, 'teams': 20, 'seasons': 10},
+}
+
+MARGIN = 0.05 # bookmaker margin of the generated prices
+HOME_ADVANTAGE = 0.3 # goals
+
+
+def sqlite_engine(path):
+    # file backed, so the refresher and callback threads share one database
+    engine = create_engine(f'sqlite:///{path}')
+
+    @event.listens_for(engine, 'connect')
+    def add_now(connection, _):
+        # the archive filter of the loaders calls Postgres now()
+        connection.create_function('now', 0, lambda: dt.datetime.now().isoformat(sep=' '))
+
+    return engine
+
+
+def season_fixtures(teams, start, rng):
+    # double round robin spread evenly over a 40 week season, weekend kick-offs
+    home, away = np.meshgrid(teams, teams, indexing='ij')
+    pairs = np.column_stack([home.ravel(), away.ravel()])
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    rng.shuffle(pairs)
+    week = np.arange(len(pairs)) * 40 // len(pairs)
+    kickoff = rng.choice([15, 17, 19, 21], size=len(pairs))
+    match_dt = pd.to_datetime(start) + pd.to_timedelta(week * 7, unit='D') + pd.to_timedelta(kickoff, unit='h')
+    return pairs, match_dt
+
+
+def generate(countries, leagues, teams, seasons, pinnacle=0.8, today=None, seed=0):
+    # synthetic odds_archive, the last season is half played so there are upcoming matches
+    rng = np.random.default_rng(seed)
+    today = pd.Timestamp(today or dt.date.today())
+    first_season = today - pd.DateOffset(weeks=20 + 52 * (seasons - 1))
+
+    frames = []
+    team_id = 0
+    for country_ix in range(countries):
+        country = f'country{country_ix}'
+        for league_ix in range(leagues):
+            league = f'league-{league_ix + 1}'
+            league_teams = np.arange(team_id, team_id + teams)
+            team_id += teams
+            strength = dict(zip(league_teams, rng.normal(0, 0.4, size=teams)))
+            for season in range(seasons):
+                pairs, match_dt = season_fixtures(league_teams, first_season + pd.DateOffset(weeks=52 * season), rng)
+                frames.append(pd.DataFrame({
+                    'country': country,
+                    'league': league,
+                    'home_id': pairs[:, 0],
+                    'away_id': pairs[:, 1],
+                    'home_strength': [strength[t] for t in pairs[:, 0]],
+                    'away_strength': [strength[t] for t in pairs[:, 1]],
+                    'match_dt': match_dt,
+                }))
+
+    df = pd.concat(frames, ignore_index=True)
+    n = len(df)
+
+    # goals from Poisson rates, prices from the same rates with a margin and some noise
+    home_rate = np.exp(0.3 + HOME_ADVANTAGE / 2 + df['home_strength'] - df['away_strength'])
+    away_rate = np.exp(0.3 - HOME_ADVANTAGE / 2 + df['away_strength'] - df['home_strength'])
+    home_goals = rng.poisson(home_rate)
+    away_goals = rng.poisson(away_rate)
+    home_prob = 1 / (1 + np.exp(-(home_rate - away_rate) * 1.2)) * 0.75
+    draw_prob = 0.27 - np.abs(home_rate - away_rate) * 0.05
+    probs = np.column_stack([home_prob, draw_prob.clip(0.15), (1 - home_prob - draw_prob).clip(0.05)])
+    probs = probs / probs.sum(axis=1, keepdims=True)
+    odds = (1 / (probs * (1 + MARGIN) * rng.normal(1, 0.02, size=probs.shape))).clip(1.01).round(2)
+    open_odds = (odds * rng.normal(1, 0.05, size=odds.shape)).clip(1.01).round(2)
+
+    finished = (df['match_dt'] < today).values
+    home_name = 'Team ' + df['home_id'].astype(str)
+    away_name = 'Team ' + df['away_id'].astype(str)
+    slug = (home_name + '-' + away_name).str.lower().str.replace(' ', '-')
+    return pd.DataFrame({
+        'match_link': 'https://www.oddsportal.com/soccer/' + df['country'] + '/' + df['league'] + '/'
+                      + slug + '-' + pd.Series(np.arange(n)).astype(str) + '/',
+        'match_dt': df['match_dt'],
+        'country': df['country'],
+        'league': df['league'],
+        'home_id': df['home_id'].astype(str),
+        'away_id': df['away_id'].astype(str),
+        'home_name': home_name,
+        'away_name': away_name,
+        'finished': finished,
+        'final_score': np.where(finished, pd.Series(home_goals).astype(str) + ':' + pd.Series(away_goals).astype(str), '-:-'),
+        'home_odds': odds[:, 0],
+        'draw_odds': odds[:, 1],
+        'away_odds': odds[:, 2],
+        'home_open_odds': open_odds[:, 0],
+        'draw_open_odds': open_odds[:, 1],
+        'away_open_odds': open_odds[:, 2],
+        'pinnacle': rng.random(n) < pinnacle,
+        'total': rng.choice([2.25, 2.5, 2.75, 3.0], size=n),
+        'handicap': rng.choice([-1.0, -0.5, -0.25, 0.0, 0.25, 0.5], size=n),
+        'updated_at': (df['match_dt'] + pd.Timedelta(hours=2)).clip(upper=today),
+    })
+
+
+def write(df, engine):
+    df.to_sql('odds_archive', engine, if_exists='replace', index=False, chunksize=10000)
+    with engine.begin() as connection:
+        # the access paths of migrations/001_odds_archive_indexes.sql
+        for cols in ['match_link', 'home_id, match_dt', 'away_id, match_dt', 'country, league, finished, match_dt',
+                     'match_dt', 'updated_at']:
+            name = 'odds_archive_' + cols.replace(', ', '_') + '_idx'
+            connection.exec_driver_sql(f'CREATE INDEX {name} ON odds_archive ({cols})')
+    return engine
+
+
+def create(path, size='small', **options):
+    # writes a synthetic archive of one of SIZES into a SQLite file and returns its engine
+    return write(generate(**{**SIZES[size], **options}), sqlite_engine(path))
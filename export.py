@@ -0,0 +1,117 @@
+import io
+import re
+import datetime as dt
+
+import flask
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # parquet exports are refused without it
+    pa = pq = None
+
+
+# Bulk export of archive slices for analysis outside the dashboard, e.g.
+#   /export?country=spain&league=laliga&from=2019-07-01&to=2020-06-30&format=parquet
+# The slice is streamed chunk by chunk as it is read from the data backend.
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+FILTERS = ['country', 'league', 'team'] # query arguments matched as they are
+VIEW_COLS = ['match', 'date_link'] # only built for the tables
+
+
+def _date(args, name):
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return dt.datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        flask.abort(400, f'{name} must be a date as YYYY-MM-DD')
+
+
+def _columns(chunk):
+    return chunk.drop(columns=VIEW_COLS, errors='ignore')
+
+
+def csv_stream(chunks):
+    header = True
+    for chunk in chunks:
+        yield _columns(chunk).to_csv(index=False, header=header, date_format='%Y-%m-%d %H:%M:%S')
+        header = False
+
+
+class _Sink(io.RawIOBase):
+    # write-only file whose bytes are taken out after every row group
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.size
+
+    def take(self):
+        data, self.parts = b''.join(self.parts), []
+        return data
+
+
+def _table(chunk, schema):
+    # categoricals as plain strings, chunks may differ in their categories
+    chunk = _columns(chunk)
+    chunk = chunk.astype({col: object for col in chunk.columns if isinstance(chunk[col].dtype, pd.CategoricalDtype)})
+    if schema is None:
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        # columns empty in the first chunk may hold strings later
+        return table.cast(pa.schema([
+            field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in table.schema
+        ]))
+    return pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+
+
+def parquet_stream(chunks):
+    # one row group per chunk
+    sink, writer = _Sink(), None
+    for chunk in chunks:
+        table = _table(chunk, writer and writer.schema)
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema)
+        writer.write_table(table)
+        yield sink.take()
+    if writer is not None:
+        writer.close()
+        yield sink.take()
+
+
+def response(source, args):
+    # streamed export of the slice of source selected by the query arguments args
+    kind = args.get('format', 'csv')
+    if kind not in FORMATS:
+        flask.abort(400, f'format must be one of {", ".join(FORMATS)}')
+    if kind == 'parquet' and pq is None:
+        flask.abort(400, 'parquet exports need pyarrow installed')
+    start, last = _date(args, 'from'), _date(args, 'to')
+    filters = {name: args[name] for name in FILTERS if args.get(name)}
+
+    chunks = source.archive_slice(
+        country=filters.get('country'),
+        league=filters.get('league'),
+        team_id=filters.get('team'),
+        start=start,
+        stop=last and last + dt.timedelta(days=1), # to is inclusive
+    )
+    stream = csv_stream(chunks) if kind == 'csv' else parquet_stream(chunks)
+    mimetype, extension = FORMATS[kind]
+    filename = re.sub(r'[^\w.-]', '-', '_'.join(['odds_archive'] + list(filters.values()))) + '.' + extension
+    return flask.Response(stream, mimetype=mimetype, headers={'Content-Disposition': f'attachment; filename="{filename}"'})
@@ -0,0 +1,118 @@
+import threading
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+import store
+
+
+FORM_N = 6 # finished matches in the form of a team
+WINDOW = 2 * FORM_N # matches read at a time per team, until FORM_N of them are finished
+
+# recent form of a team over its last finished matches, results latest first as W/D/L
+Form = namedtuple('Form', ['matches', 'results', 'points', 'goals_for', 'goals_against', 'avg_odds', 'beat_open'])
+
+FORMS = {} # team_id -> Form, replaced as a whole on every full load
+_LOCK = threading.Lock()
+SOURCE = store
+
+
+def team_rows(df):
+    # one row per team and finished match, seen from the team's side
+    df = df[df['match_outcome'].notna()]
+    outcome = df['match_outcome'].astype(object)
+    sides = []
+    for side, rival, win in [('home', 'away', 'home'), ('away', 'home', 'away')]:
+        sides.append(pd.DataFrame({
+            'team_id': df[f'{side}_id'].astype(object),
+            'match_dt': df['match_dt'],
+            'result': np.select([outcome == win, outcome == 'draw'], ['W', 'D'], 'L'),
+            'goals_for': df[f'{side}_goals'].astype(float),
+            'goals_against': df[f'{rival}_goals'].astype(float),
+            'odds': df[f'{side}_odds'].astype(float),
+            'open_odds': df[f'{side}_open_odds'].astype(float),
+        }))
+    return pd.concat(sides, ignore_index=True)
+
+
+def aggregate(rows, last_n=FORM_N):
+    # team_id -> Form of the last_n matches of every team in rows
+    rows = rows.sort_values('match_dt', ascending=False, kind='mergesort').groupby('team_id', sort=False).head(last_n)
+    rows = rows.assign(
+        points=rows['result'].map({'W': 3, 'D': 1, 'L': 0}),
+        # the market moved towards the team
+        beat_open=np.where((rows['odds'] > 1) & (rows['open_odds'] > 1), rows['odds'] < rows['open_odds'], np.nan),
+    )
+    table = rows.groupby('team_id', sort=False).agg(
+        matches=('result', 'size'),
+        results=('result', ''.join),
+        points=('points', 'sum'),
+        goals_for=('goals_for', 'sum'),
+        goals_against=('goals_against', 'sum'),
+        avg_odds=('odds', 'mean'),
+        beat_open=('beat_open', 'mean'),
+    )
+    return {team_id: Form(*values) for team_id, values in zip(table.index, table.itertuples(index=False))}
+
+
+def team_history(team_id):
+    # latest matches of the team, enough of them to hold FORM_N finished ones
+    pages, start, finished = [], 0, 0
+    while True:
+        page = SOURCE.team_matches(team_id, start, start + WINDOW)
+        pages.append(page)
+        finished += page['match_outcome'].notna().sum()
+        if finished >= FORM_N or len(page) < WINDOW:
+            return pd.concat(pages)
+        start += WINDOW
+
+
+def compute(team_ids):
+    # forms of a few teams from their own histories, without going over the whole archive
+    df = pd.concat([team_history(team_id) for team_id in team_ids]).drop_duplicates('match_link')
+    rows = team_rows(df)
+    return aggregate(rows[rows['team_id'].isin(team_ids)])
+
+
+def team_form(team_id):
+    # materialized form of a team, computed on the first read when it isn't there yet
+    form = FORMS.get(team_id)
+    if form is None:
+        form = compute([team_id]).get(team_id)
+        if form is not None:
+            FORMS[team_id] = form
+    return form
+
+
+def on_refresh(snapshot, changed):
+    global FORMS
+
+    with _LOCK:
+        if changed is None:
+            # full load: every team at once from the snapshot, the sql backend fills in on read
+            data = getattr(snapshot, 'data', None)
+            FORMS = aggregate(team_rows(data)) if data is not None and not data.empty else {}
+            return
+
+        # new results only change the form of the teams that played
+        teams = list(set(changed['home_id'].astype(object)) | set(changed['away_id'].astype(object)))
+        forms = {team_id: form for team_id, form in FORMS.items() if team_id not in teams}
+        data = getattr(snapshot, 'data', None)
+        if data is None:
+            forms.update(compute(teams))
+        else:
+            played = data[data['home_id'].isin(teams) | data['away_id'].isin(teams)]
+            rows = team_rows(played)
+            forms.update(aggregate(rows[rows['team_id'].isin(teams)]))
+        FORMS = forms
+
+
+def attach(source):
+    # keep the forms in step with the data backend the views are rendered from
+    global SOURCE
+
+    SOURCE = source
+    source.add_listener(on_refresh)
+    if source.current().version:
+        on_refresh(source.current(), None)
@@ -0,0 +1,30 @@
+import json
+import logging
+
+from sqlalchemy import create_engine
+
+import store
+import snapshots
+import odds_history
+
+
+# Owns odds_archive in shared mode: start it once next to the web workers, all of them
+# with the same ODDSTAB_SHARED_DIR, e.g.
+#   ODDSTAB_SHARED_DIR=/dev/shm/oddstab python loader.py
+#   ODDSTAB_SHARED_DIR=/dev/shm/oddstab gunicorn -w 4 app:server
+if __name__ == '__main__':
+    logging.basicConfig(
+    filename='./oddstab.log',
+    filemode='a',
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.ERROR)
+
+    if not snapshots.SHARED_DIR:
+        raise SystemExit('set ODDSTAB_SHARED_DIR to the directory shared with the web workers')
+
+    with open('./valid_users.json') as handle:
+        VALID_USERNAME_PASSWORD_PAIRS = json.loads(handle.read())
+
+    ENGINE = create_engine('postgresql://' + VALID_USERNAME_PASSWORD_PAIRS['postgresql'])
+    store.add_listener(odds_history.on_refresh)
+    store.run_loader(ENGINE)
@@ -0,0 +1,59 @@
+import numpy as np
+
+
+def implied_probabilities(odds):
+    odds = np.asarray(odds, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        probs = 1 / odds
+    # rows with a missing or broken price can't be normalized
+    probs[~(odds > 1).all(axis=1)] = np.nan
+    return probs
+
+
+def proportional(probs):
+    return probs / probs.sum(axis=1, keepdims=True)
+
+
+def power(probs, iterations=40):
+    # find k with sum(p ** k) == 1 for every row at once by bisection,
+    # sum(p ** 0) == 3 > 1 and sum(p ** 20) is far below 1 for any real book
+    low = np.zeros((len(probs), 1))
+    high = np.full((len(probs), 1), 20.0)
+    for _ in range(iterations):
+        k = (low + high) / 2
+        too_high = (probs ** k).sum(axis=1, keepdims=True) > 1
+        low = np.where(too_high, k, low)
+        high = np.where(too_high, high, k)
+    return probs ** ((low + high) / 2)
+
+
+def shin(probs, iterations=40):
+    # share of insider money z from Shin (1993), found by bisection so that
+    # the fair probabilities of every row add up to 1
+    booksum = probs.sum(axis=1, keepdims=True)
+
+    def fair(z):
+        return (np.sqrt(z ** 2 + 4 * (1 - z) * probs ** 2 / booksum) - z) / (2 * (1 - z))
+
+    low = np.zeros((len(probs), 1))
+    high = np.full((len(probs), 1), 0.5)
+    for _ in range(iterations):
+        z = (low + high) / 2
+        too_low = fair(z).sum(axis=1, keepdims=True) > 1
+        low = np.where(too_low, z, low)
+        high = np.where(too_low, high, z)
+    return fair((low + high) / 2)
+
+
+METHODS = {
+    'proportional': proportional,
+    'power': power,
+    'shin': shin,
+}
+
+
+def true_odds(odds, method='shin'):
+    # odds without bookmaker margin for a whole (rows x outcomes) block of prices
+    probs = METHODS[method](implied_probabilities(odds))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 1 / probs
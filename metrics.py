@@ -0,0 +1,184 @@
+import os
+import time
+import logging
+import datetime as dt
+import functools
+import threading
+
+import flask
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+# latency buckets of every timed function and request, seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# callback requests slower than this are written to the log, off when unset
+SLOW_SECONDS = float(os.environ['ODDSTAB_SLOW_SECONDS']) if os.environ.get('ODDSTAB_SLOW_SECONDS') else None
+
+CALLBACK_PATH = '/_dash-update-component'
+
+
+class Timer:
+    # calls, wall time, latency buckets, rows returned and scanned and payload bytes of one
+    # instrumented name
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.rows = 0
+        self.scanned_rows = 0
+        self.bytes = 0
+
+    def observe(self, seconds, rows=0, size=0, scanned_rows=0):
+        self.count += 1
+        self.seconds += seconds
+        for ix, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[ix] += 1
+        self.rows += rows
+        self.scanned_rows += scanned_rows
+        self.bytes += size
+
+    def copy(self):
+        timer = Timer()
+        timer.count, timer.seconds, timer.rows, timer.bytes = self.count, self.seconds, self.rows, self.bytes
+        timer.scanned_rows = self.scanned_rows
+        timer.buckets = list(self.buckets)
+        return timer
+
+
+_TIMERS = {} # (kind, name) -> Timer
+_LOCK = threading.Lock()
+_CALL = threading.local() # rows scanned so far by the innermost timed call of the thread, None outside one
+
+
+def observe(kind, name, seconds, rows=0, size=0, scanned_rows=0):
+    with _LOCK:
+        timer = _TIMERS.get((kind, name))
+        if timer is None:
+            timer = _TIMERS[(kind, name)] = Timer()
+        timer.observe(seconds, rows, size, scanned_rows)
+
+
+def scanned(rows):
+    # rows the running timed call reads before filtering them, e.g. from the database
+    if getattr(_CALL, 'rows', None) is not None:
+        _CALL.rows += rows
+
+
+def count_rows(result):
+    # rows a data layer call returned: frames, single rows, lists of frames and snapshots
+    if isinstance(result, pd.DataFrame):
+        return len(result)
+    if isinstance(result, pd.Series):
+        return 1
+    if isinstance(result, list):
+        return sum(len(item) for item in result if isinstance(item, pd.DataFrame))
+    if isinstance(getattr(result, 'data', None), pd.DataFrame):
+        return len(result.data)
+    return 0
+
+
+def timed(name, kind='data', rows=count_rows):
+    # records the wall time, returned rows and scanned rows of every call of the decorated
+    # function. A call scans the rows returned to it by the timed calls it makes and the rows
+    # it reports with scanned(), at least the rows it returns itself
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            outer, _CALL.rows = getattr(_CALL, 'rows', None), 0
+            started = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+                read = _CALL.rows
+            finally:
+                _CALL.rows = outer
+            elapsed = time.perf_counter() - started
+            returned = rows(result)
+            scanned(returned)
+            observe(kind, name, elapsed, returned, scanned_rows=max(read, returned))
+            return result
+        return wrapper
+    return decorate
+
+
+def _request_started():
+    flask.g.metrics_started = time.perf_counter()
+
+
+def _request_finished(response):
+    # whole callback requests: body, serialization and the bytes sent, per output
+    started = flask.g.pop('metrics_started', None)
+    if started is None or not flask.request.path.endswith(CALLBACK_PATH):
+        return response
+    elapsed = time.perf_counter() - started
+    body = flask.request.get_json(silent=True) or {}
+    output = body.get('output', 'unknown')
+    size = response.calculate_content_length() or 0
+    observe('request', output, elapsed, size=size)
+    if SLOW_SECONDS is not None and elapsed > SLOW_SECONDS:
+        logger.warning('slow callback request %s: %.3fs, %d bytes, inputs %s', output, elapsed, size, body.get('inputs'))
+    return response
+
+
+def log_warnings(module_logger):
+    # oddstab.log only takes errors otherwise, see app.py
+    module_logger.setLevel(logging.WARNING)
+
+
+def attach(server):
+    # time the Dash callback requests of a Flask server
+    server.before_request(_request_started)
+    server.after_request(_request_finished)
+    if SLOW_SECONDS is not None:
+        log_warnings(logger)
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _timer_lines(kind, timers):
+    metric = f'oddstab_{kind}_seconds'
+    lines = [f'# TYPE {metric} histogram']
+    for name, timer in timers:
+        for bound, count in zip(BUCKETS, timer.buckets):
+            lines.append(f'{metric}_bucket{_labels(name=name, le=bound)} {count}')
+        lines.append(f'{metric}_bucket{_labels(name=name, le="+Inf")} {timer.count}')
+        lines.append(f'{metric}_sum{_labels(name=name)} {timer.seconds:.6f}')
+        lines.append(f'{metric}_count{_labels(name=name)} {timer.count}')
+    for total in ['rows', 'scanned_rows', 'bytes']:
+        values = [(name, getattr(timer, total)) for name, timer in timers if getattr(timer, total)]
+        if values:
+            lines.append(f'# TYPE oddstab_{kind}_{total}_total counter')
+            lines += [f'oddstab_{kind}_{total}_total{_labels(name=name)} {value}' for name, value in values]
+    return lines
+
+
+def render(snapshot, cache_stats):
+    # Prometheus text exposition of the timers, the served snapshot and the render cache
+    with _LOCK:
+        timers = sorted((kind, name, timer.copy()) for (kind, name), timer in _TIMERS.items())
+
+    lines = []
+    for kind in sorted({kind for kind, _, _ in timers}):
+        lines += _timer_lines(kind, [(name, timer) for k, name, timer in timers if k == kind])
+
+    lines += ['# TYPE oddstab_snapshot_version gauge', f'oddstab_snapshot_version {snapshot.version}']
+    if snapshot.loaded_at is not None:
+        age = (dt.datetime.now() - snapshot.loaded_at).total_seconds()
+        lines += ['# TYPE oddstab_snapshot_age_seconds gauge', f'oddstab_snapshot_age_seconds {age:.3f}']
+    if isinstance(getattr(snapshot, 'data', None), pd.DataFrame):
+        lines += ['# TYPE oddstab_snapshot_rows gauge', f'oddstab_snapshot_rows {len(snapshot.data)}']
+
+    for key, value in cache_stats.items():
+        metric = f'oddstab_render_cache_{key}' if key == 'entries' else f'oddstab_render_cache_{key}_total'
+        lines += [f'# TYPE {metric} {"gauge" if key == "entries" else "counter"}', f'{metric} {value}']
+    return '\n'.join(lines) + '\n'
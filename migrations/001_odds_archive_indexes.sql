@@ -0,0 +1,35 @@
+-- Access paths of the dashboard views. Needed by the SQL backend (ODDSTAB_BACKEND=sql),
+-- the in-memory store only uses the updated_at index for its delta refresh.
+
+-- change watermark of the delta refresh, bumped on every update of a row
+ALTER TABLE odds_archive ADD COLUMN IF NOT EXISTS updated_at timestamp NOT NULL DEFAULT now();
+
+CREATE OR REPLACE FUNCTION odds_archive_touch() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := now();
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS odds_archive_touch ON odds_archive;
+CREATE TRIGGER odds_archive_touch BEFORE UPDATE ON odds_archive
+    FOR EACH ROW EXECUTE PROCEDURE odds_archive_touch();
+
+-- country is otherwise only known by parsing match_link
+ALTER TABLE odds_archive
+    ADD COLUMN IF NOT EXISTS country text
+    GENERATED ALWAYS AS (substring(match_link from 'soccer/([^/]*)/')) STORED;
+
+-- match view: selected match
+CREATE UNIQUE INDEX IF NOT EXISTS odds_archive_match_link_idx ON odds_archive (match_link);
+
+-- team history and h2h, latest first
+CREATE INDEX IF NOT EXISTS odds_archive_home_id_match_dt_idx ON odds_archive (home_id, match_dt DESC);
+CREATE INDEX IF NOT EXISTS odds_archive_away_id_match_dt_idx ON odds_archive (away_id, match_dt DESC);
+
+-- league table, match list and the country/league dropdowns
+CREATE INDEX IF NOT EXISTS odds_archive_country_league_idx ON odds_archive (country, league, finished, match_dt);
+
+-- archive filter of every query and the delta refresh
+CREATE INDEX IF NOT EXISTS odds_archive_match_dt_idx ON odds_archive (match_dt);
+CREATE INDEX IF NOT EXISTS odds_archive_updated_at_idx ON odds_archive (updated_at);
@@ -0,0 +1,17 @@
+-- updated_at is the watermark of the delta refresh. now() is the start of the writing
+-- transaction, so rows of a long transaction were stamped well before they became visible.
+-- clock_timestamp() stamps them when they are written; the refresh reads again a few minutes
+-- below its watermark (store.REFRESH_LAG) for what is still in flight.
+ALTER TABLE odds_archive ALTER COLUMN updated_at SET DEFAULT clock_timestamp();
+
+CREATE OR REPLACE FUNCTION odds_archive_touch() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := clock_timestamp();
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+-- inserts that set updated_at themselves are stamped as well
+DROP TRIGGER IF EXISTS odds_archive_touch ON odds_archive;
+CREATE TRIGGER odds_archive_touch BEFORE INSERT OR UPDATE ON odds_archive
+    FOR EACH ROW EXECUTE PROCEDURE odds_archive_touch();
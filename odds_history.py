@@ -0,0 +1,215 @@
+import os
+import fcntl
+import contextlib
+import threading
+from array import array
+
+import numpy as np
+import pandas as pd
+
+# Append-only history of the odds of every match. Only changes are recorded, each one as a
+# fixed size tick delta-encoded against the previous tick of the same match:
+#   links.tsv   one line per match: match_link, first tick time (unix seconds)
+#   ticks.bin   TICK records, link is the line number in links.tsv
+# Every process tails the files. Writers (the app workers, or loader.py in shared mode) take
+# a file lock and catch up with the others before they append, so link ids stay in step.
+HISTORY_DIR = os.environ.get('ODDSTAB_HISTORY_DIR', './odds_history')
+LINKS_FILE = 'links.tsv'
+TICKS_FILE = 'ticks.bin'
+LOCK_FILE = 'write.lock' # held by the writing process, several app workers may record at once
+
+SIDES = ['home', 'draw', 'away']
+ODDS_COLS = [f'{side}_odds' for side in SIDES]
+TICK = np.dtype([('link', '<u4'), ('dts', '<u4'), ('dodds', '<i2', (3,))])
+MAX_ODDS = 32767 # hundredths, odds above 327.67 are stored as 327.67
+MAX_POINTS = 300 # points per chart, longer histories are downsampled
+
+
+class Track:
+    # history of one match as deltas: seconds since the previous tick and odds
+    # in hundredths against the previous tick, 0 for a missing price
+
+    def __init__(self, base_ts):
+        self.base_ts = base_ts
+        self.dts = array('I')
+        self.dodds = array('h')
+        self.last_ts = base_ts
+        self.last_odds = (0, 0, 0)
+
+    def push(self, ts, odds):
+        # appends one tick, returns its deltas
+        dts = max(ts - self.last_ts, 0)
+        dodds = tuple(new - old for new, old in zip(odds, self.last_odds))
+        self.dts.append(dts)
+        self.dodds.extend(dodds)
+        self.last_ts += dts
+        self.last_odds = tuple(odds)
+        return dts, dodds
+
+    def add(self, dts, dodds):
+        self.dts.extend(dts)
+        self.dodds.extend(dodds.ravel())
+        self.last_ts += int(np.sum(dts, dtype=np.int64))
+        self.last_odds = tuple(np.add(self.last_odds, dodds.sum(axis=0, dtype=np.int64)).tolist())
+
+    def decode(self):
+        ts = self.base_ts + np.cumsum(np.frombuffer(self.dts, dtype=np.uint32), dtype=np.int64)
+        odds = np.cumsum(np.frombuffer(self.dodds, dtype=np.int16).reshape(-1, 3), axis=0, dtype=np.int32)
+        return ts, odds
+
+
+def hundredths(odds):
+    odds = np.asarray(odds, dtype=float)
+    with np.errstate(invalid='ignore'):
+        return np.where(odds > 1, np.minimum(np.round(odds * 100), MAX_ODDS), 0).astype(np.int64)
+
+
+def downsample(ts, max_points):
+    # positions of the last tick in each of max_points even time buckets, plus the first tick
+    if len(ts) <= max_points:
+        return np.arange(len(ts))
+    edges = np.linspace(ts[0], ts[-1], max_points + 1)[1:]
+    return np.unique(np.concatenate([[0], np.searchsorted(ts, edges, side='right') - 1]))
+
+
+class OddsHistory:
+
+    def __init__(self, path=HISTORY_DIR):
+        self.path = path
+        self._links = [] # link id -> match_link
+        self._ids = {} # match_link -> link id
+        self._tracks = {} # link id -> Track
+        self._links_offset = 0
+        self._ticks_offset = 0
+        self._lock = threading.Lock()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def sync(self):
+        # apply whatever the writer appended since the last sync
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        # every link is written before its ticks, so reading the ticks size first never
+        # leaves a tick without its link
+        ticks_size = os.path.getsize(self._file(TICKS_FILE)) if os.path.exists(self._file(TICKS_FILE)) else 0
+        ticks_size -= (ticks_size - self._ticks_offset) % TICK.itemsize
+        try:
+            with open(self._file(LINKS_FILE), 'rb') as handle:
+                handle.seek(self._links_offset)
+                lines = handle.read()
+        except OSError:
+            return
+        complete = lines.rfind(b'\n') + 1
+        for line in lines[:complete].decode().splitlines():
+            match_link, base_ts = line.split('\t')
+            self._register(match_link, int(base_ts))
+        self._links_offset += complete
+
+        if ticks_size <= self._ticks_offset:
+            return
+        with open(self._file(TICKS_FILE), 'rb') as handle:
+            handle.seek(self._ticks_offset)
+            ticks = np.frombuffer(handle.read(ticks_size - self._ticks_offset), dtype=TICK)
+        self._apply(ticks)
+        self._ticks_offset = ticks_size
+
+    def _register(self, match_link, base_ts):
+        link_id = len(self._links)
+        self._links.append(match_link)
+        self._ids[match_link] = link_id
+        self._tracks[link_id] = Track(base_ts)
+        return link_id
+
+    def _apply(self, ticks):
+        order = np.argsort(ticks['link'], kind='mergesort')
+        ticks = ticks[order]
+        links, starts = np.unique(ticks['link'], return_index=True)
+        for link_id, part in zip(links.tolist(), np.split(ticks, starts[1:])):
+            self._tracks[link_id].add(part['dts'], part['dodds'])
+
+    def append(self, df):
+        # records the odds of every row that differ from the last recorded ones of its match,
+        # ticks are stamped with updated_at when the archive has it
+        if df.empty or not set(ODDS_COLS).issubset(df.columns):
+            return 0
+        odds = hundredths(df[ODDS_COLS].to_numpy())
+        if 'updated_at' in df.columns:
+            stamps = pd.to_datetime(df['updated_at']).fillna(pd.Timestamp.now())
+        else:
+            stamps = pd.Series(pd.Timestamp.now(), index=df.index)
+        ts = (stamps.to_numpy(dtype='datetime64[s]').astype(np.int64)).tolist()
+
+        new_links, ticks = [], []
+        with self._lock, self._write_lock():
+            self._sync()
+            for match_link, tick_ts, tick_odds in zip(df['match_link'].tolist(), ts, odds.tolist()):
+                if not any(tick_odds):
+                    continue
+                link_id = self._ids.get(match_link)
+                if link_id is None:
+                    link_id = self._register(match_link, tick_ts)
+                    new_links.append(f'{match_link}\t{tick_ts}\n')
+                track = self._tracks[link_id]
+                if tuple(tick_odds) != track.last_odds:
+                    ticks.append((link_id, *track.push(tick_ts, tick_odds)))
+
+            if new_links or ticks:
+                self._write(''.join(new_links).encode(), np.array(ticks, dtype=TICK).tobytes())
+        return len(ticks)
+
+    @contextlib.contextmanager
+    def _write_lock(self):
+        # exclusive between processes, released when the file is closed
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._file(LOCK_FILE), 'a') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            yield
+
+    def _write(self, links, ticks):
+        with open(self._file(LINKS_FILE), 'ab') as handle:
+            handle.write(links)
+        with open(self._file(TICKS_FILE), 'ab') as handle:
+            handle.write(ticks)
+        # the writer already holds what it wrote
+        self._links_offset += len(links)
+        self._ticks_offset += len(ticks)
+
+    def read(self, match_link, start=None, stop=None, max_points=MAX_POINTS):
+        # odds of one match between start and stop, only its own ticks are decoded
+        self.sync()
+        link_id = self._ids.get(match_link)
+        if link_id is None:
+            return pd.DataFrame(columns=['ts'] + ODDS_COLS)
+        ts, odds = self._tracks[link_id].decode()
+
+        lo = 0 if start is None else np.searchsorted(ts, pd.Timestamp(start).value // 10 ** 9)
+        hi = len(ts) if stop is None else np.searchsorted(ts, pd.Timestamp(stop).value // 10 ** 9, side='right')
+        ts, odds = ts[lo:hi], odds[lo:hi]
+        keep = downsample(ts, max_points)
+        df = pd.DataFrame(np.where(odds[keep] > 0, odds[keep] / 100, np.nan), columns=ODDS_COLS)
+        df.insert(0, 'ts', pd.to_datetime(ts[keep], unit='s'))
+        return df
+
+    def stats(self):
+        with self._lock:
+            return {'matches': len(self._links), 'ticks': self._ticks_offset // TICK.itemsize}
+
+
+def on_refresh(snapshot, changed):
+    # the new versions of the changed rows come last in changed
+    rows = snapshot.data if changed is None else changed.drop_duplicates('match_link', keep='last')
+    HISTORY.append(rows)
+
+
+def record(source):
+    # make this process the writer of the history, fed by every refresh of source
+    HISTORY.sync()
+    source.add_listener(on_refresh)
+    if source.current().version:
+        on_refresh(source.current(), None)
+
+
+HISTORY = OddsHistory()
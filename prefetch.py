@@ -0,0 +1,121 @@
+import time
+import queue
+import logging
+import itertools
+import threading
+from collections import Counter
+
+import flask
+
+import metrics
+import views
+
+
+logger = logging.getLogger(__name__)
+
+# Renders the match views of the listed fixtures into the render cache before they are
+# opened. Low priority by design: few workers, a bounded queue, and no work while the
+# server is busy with live callbacks.
+WORKERS = 2
+MAX_QUEUED = 200 # fixtures waiting, later ones are dropped
+MAX_FIXTURES = 30 # fixtures queued per listed league
+MAX_LIVE = 1 # workers pause while this many callback requests are in flight
+MAX_OPENS = 5000 # matches with an open count, above it every count is halved
+IDLE_WAIT = 0.05 # seconds between checks for a quiet server
+
+QUEUE = queue.PriorityQueue(MAX_QUEUED)
+OPENS = Counter() # match_link -> times the match view was opened, decayed
+_queued = set()
+_done = set() # match_links prefetched at _done_version
+_done_version = None
+_live = 0
+_order = itertools.count()
+_lock = threading.Lock()
+
+
+def opened(match_link):
+    global OPENS
+
+    with _lock:
+        if len(OPENS) >= MAX_OPENS:
+            # old opens fade out, matches opened only once drop out
+            OPENS = Counter({link: count // 2 for link, count in OPENS.items() if count > 1})
+        OPENS[match_link] += 1
+
+
+def _prefetched(version):
+    # matches prefetched at version, the set of an older version is dropped
+    global _done, _done_version
+
+    if _done_version is not None and version < _done_version:
+        return set() # rendered from a snapshot a refresh already replaced
+    if version != _done_version:
+        _done, _done_version = set(), version
+    return _done
+
+
+def schedule(country, league):
+    # queue the upcoming fixtures of a league, most opened first, then nearest kickoff
+    version = views.STORE.current().version
+    fixtures = views.STORE.league_matches(country, league)
+    fixtures = fixtures[fixtures['match_dt'] >= views.today()].head(MAX_FIXTURES)
+    queued = 0
+    with _lock:
+        done = _prefetched(version)
+        for match_link, kickoff in zip(fixtures['match_link'], fixtures['match_dt']):
+            if match_link in _queued or match_link in done:
+                continue
+            try:
+                QUEUE.put_nowait((-OPENS[match_link], kickoff, next(_order), match_link))
+            except queue.Full:
+                break
+            _queued.add(match_link)
+            queued += 1
+    return queued
+
+
+@metrics.timed('match_tabs', kind='prefetch')
+def render(match_link):
+    # the same entries create_match_tabs reads first
+    version = views.STORE.current().version
+    views.cached_team_odds_tab(match_link, 'home', False, page=0)
+    views.cached_team_odds_tab(match_link, 'away', False, page=0)
+    views.cached_h2h_tab(match_link, False, page=0)
+    with _lock:
+        _prefetched(version).add(match_link)
+
+
+def _work():
+    while True:
+        *_, match_link = QUEUE.get()
+        with _lock:
+            _queued.discard(match_link)
+        while _live >= MAX_LIVE:
+            time.sleep(IDLE_WAIT)
+        try:
+            render(match_link)
+        except Exception:
+            logger.exception('prefetch of %s failed', match_link)
+
+
+def _request_started():
+    global _live
+    if flask.request.path.endswith(metrics.CALLBACK_PATH):
+        with _lock:
+            _live += 1
+        flask.g.prefetch_live = True
+
+
+def _request_finished(_):
+    global _live
+    if flask.g.pop('prefetch_live', False):
+        with _lock:
+            _live -= 1
+
+
+def start(server, workers=WORKERS):
+    # count the live callback requests of server and start the prefetch workers
+    server.before_request(_request_started)
+    server.teardown_request(_request_finished)
+    for ix in range(workers):
+        threading.Thread(target=_work, name=f'prefetch-{ix}', daemon=True).start()
@@ -0,0 +1,117 @@
+import threading
+from collections import OrderedDict
+
+import store
+
+
+MAX_ENTRIES = 512
+
+
+class RenderCache:
+    # bounded LRU of rendered table outputs. Every entry remembers the snapshot version
+    # it was rendered from and the teams/leagues it shows, so a refresh only drops the
+    # entries whose teams or leagues it touched
+
+    def __init__(self, max_entries=MAX_ENTRIES, source=store):
+        self.max_entries = max_entries
+        self.source = source # store or sql_store, whichever serves the views
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict() # key -> (version, tags, value)
+        self._touched = {} # tag -> last snapshot version that changed it
+        self._cleared = 0 # last snapshot version that changed everything
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, version, tags):
+        if version < self._cleared:
+            return False
+        return all(self._touched.get(tag, 0) <= version for tag in tags)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, value, tags, version):
+        with self._lock:
+            # a refresh may have landed while the value was rendered from the older snapshot
+            if not self._is_fresh(version, tags):
+                return
+            self._entries[key] = (version, tuple(tags), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_render(self, key, tags, render, *args):
+        value = self.get(key)
+        if value is None:
+            version = self.source.current().version
+            value = render(*args)
+            self.put(key, value, tags, version)
+        return value
+
+    def invalidate(self, tags, version):
+        tags = set(tags)
+        with self._lock:
+            for tag in tags:
+                self._touched[tag] = version
+            stale = [key for key, (_, entry_tags, _) in self._entries.items() if tags.intersection(entry_tags)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self, version):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._touched.clear()
+            self._cleared = version
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+def team_tag(team_id):
+    return ('team', team_id)
+
+
+def league_tag(country, league):
+    return ('league', country, league)
+
+
+def changed_tags(changed):
+    tags = {team_tag(team_id) for team_id in changed['home_id']}
+    tags.update(team_tag(team_id) for team_id in changed['away_id'])
+    tags.update(league_tag(country, league) for country, league in zip(changed['country'], changed['league']))
+    return tags
+
+
+def on_refresh(snapshot, changed):
+    if changed is None:
+        CACHE.clear(snapshot.version)
+    else:
+        CACHE.invalidate(changed_tags(changed), snapshot.version)
+
+
+def attach(source):
+    # follow the refreshes of the data backend the views are rendered from
+    CACHE.source = source
+    source.add_listener(on_refresh)
+
+
+CACHE = RenderCache()
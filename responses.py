@@ -0,0 +1,172 @@
+import os
+import gzip
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import flask
+
+import metrics
+import store
+
+try:
+    import brotli
+except ImportError: # gzip only
+    brotli = None
+
+
+logger = logging.getLogger(__name__)
+
+# Flask-Compress settings of the Dash server: assets, layout, exports and metrics
+COMPRESS_CONFIG = {
+    'COMPRESS_ALGORITHM': ['br', 'gzip'],
+    'COMPRESS_LEVEL': 6, # gzip
+    'COMPRESS_BR_LEVEL': 4, # brotli, higher levels cost more than they save on short lived responses
+    'COMPRESS_MIN_SIZE': 500, # bytes
+    'COMPRESS_MIMETYPES': ['text/html', 'text/css', 'text/plain', 'text/csv', 'application/json', 'application/javascript'],
+}
+
+# Callback responses that only depend on their inputs and the data version are kept encoded
+# and sent again as they are for the same inputs, until the version changes
+CACHED_OUTPUTS = {
+    'odds-table', 'home-tab', 'away-tab', 'h2h-tab', 'movement-tab',
+    'table-home-side', 'table-away-side', 'table-h2h', 'nav-index',
+}
+MAX_ENTRIES = 256
+
+# callback responses larger than this, uncompressed, are written to the log
+BUDGET_BYTES = int(os.environ.get('ODDSTAB_RESPONSE_BUDGET', 256 * 1024))
+
+
+def _encode(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=COMPRESS_CONFIG['COMPRESS_BR_LEVEL'])
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=COMPRESS_CONFIG['COMPRESS_LEVEL'])
+    return data
+
+
+def _encoding(accept_encoding):
+    # preferred encoding the client accepts, identity when none
+    accepted = {part.split(';')[0].strip() for part in accept_encoding.lower().split(',')}
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return 'identity'
+
+
+class ResponseCache:
+    # bounded LRU of callback response bodies, every entry holds the body in every encoding
+    # it was sent in so far
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # (version, request hash) -> {encoding: body}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, data):
+        entry = {'identity': data}
+        with self._lock:
+            # entries of older versions can't be hit anymore
+            for old in [old for old in self._entries if old[0] != key[0]]:
+                del self._entries[old]
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def body(self, entry, encoding):
+        if encoding not in entry:
+            entry[encoding] = _encode(entry['identity'], encoding)
+        return entry[encoding]
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+def _request_key(body):
+    # what the callback output is computed from, changedPropIds only names the trigger; the
+    # version counts the publishes of this process, so it only keys this process' cache
+    outputs = body.get('outputs')
+    outputs = outputs if isinstance(outputs, list) else [outputs]
+    if not all(isinstance(output, dict) and output.get('id') in CACHED_OUTPUTS for output in outputs):
+        return None
+    request = json.dumps([body.get('output'), body.get('inputs'), body.get('state')], sort_keys=True)
+    return (SOURCE.current().version, hashlib.blake2b(request.encode(), digest_size=16).hexdigest())
+
+
+def _send(entry):
+    encoding = _encoding(flask.request.headers.get('Accept-Encoding', ''))
+    response = flask.Response(CACHE.body(entry, encoding), mimetype='application/json')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def _request_started():
+    if flask.request.method != 'POST' or not flask.request.path.endswith(metrics.CALLBACK_PATH):
+        return None
+    key = _request_key(flask.request.get_json(silent=True) or {})
+    if key is None or not AUTHORIZED():
+        return None # the view answers unauthorized requests
+    entry = CACHE.get(key)
+    if entry is None:
+        flask.g.response_key = key
+        return None
+    # the same inputs at the same data version: the callback would return the same body
+    flask.g.response_cached = True
+    return _send(entry)
+
+
+def _request_finished(response):
+    key = flask.g.pop('response_key', None)
+    if flask.g.pop('response_cached', False):
+        return response
+    if not flask.request.path.endswith(metrics.CALLBACK_PATH) or response.status_code != 200:
+        return response
+
+    data = response.get_data()
+    if len(data) > BUDGET_BYTES:
+        body = flask.request.get_json(silent=True) or {}
+        logger.warning(
+            'callback response %s over budget: %d bytes, inputs %s', body.get('output'), len(data), body.get('inputs')
+        )
+    # a refresh may have landed while the callback ran
+    if key is None or key[0] != SOURCE.current().version:
+        return response
+    return _send(CACHE.put(key, data))
+
+
+def attach(server, source=store, authorized=lambda: True):
+    # cache, compress and size check the callback responses of a Flask server, cached
+    # responses are only sent when authorized() passes, the views check it themselves
+    global SOURCE, AUTHORIZED
+
+    SOURCE = source
+    AUTHORIZED = authorized
+    server.before_request(_request_started)
+    server.after_request(_request_finished)
+    # over budget responses are warnings
+    metrics.log_warnings(logger)
+
+
+CACHE = ResponseCache()
+SOURCE = store
+AUTHORIZED = lambda: True
@@ -0,0 +1,127 @@
+import heapq
+import threading
+
+import numpy as np
+import pandas as pd
+
+import store
+
+
+SIDES = np.array(['home', 'draw', 'away'])
+ODDS_COLS = ['home_odds', 'draw_odds', 'away_odds']
+OPEN_ODDS_COLS = ['home_open_odds', 'draw_open_odds', 'away_open_odds']
+TOP_K = 50 # matches ranked per filter
+MIN_DROP = 0.01 # smaller moves are not ranked
+
+# biggest odds drops against open over the unfinished matches of every country
+MOVE_COLS = ['country', 'league', 'match_dt', 'date_link', 'home_name', 'away_name', 'pinnacle', 'side', 'open_odds', 'odds', 'drop']
+NO_MOVES = pd.DataFrame(columns=MOVE_COLS).astype({'pinnacle': bool, 'drop': float})
+MOVES = NO_MOVES # match_link -> move of every ranked unfinished match
+TOP = {False: [], True: []} # pinnacle only -> match_links of the TOP_K biggest drops, biggest first
+_LOCK = threading.Lock()
+SOURCE = store
+
+
+def moves(df):
+    # the side whose odds shortened the most against its open odds in every unfinished row,
+    # rows without a drop of MIN_DROP are left out
+    df = df[~df['finished'].astype(bool)]
+    odds = df[ODDS_COLS].to_numpy(dtype=float)
+    open_odds = df[OPEN_ODDS_COLS].to_numpy(dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        drop = np.where((odds > 1) & (open_odds > 1), 1 - odds / open_odds, -np.inf)
+    side = drop.argmax(axis=1) if len(df) else np.array([], dtype=int)
+    rows = np.arange(len(df))
+    result = pd.DataFrame({
+        'country': df['country'].astype(object).to_numpy(),
+        'league': df['league'].astype(object).to_numpy(),
+        'match_dt': df['match_dt'].to_numpy(),
+        'date_link': df['date_link'].to_numpy(),
+        'home_name': df['home_name'].astype(object).to_numpy(),
+        'away_name': df['away_name'].astype(object).to_numpy(),
+        'pinnacle': df['pinnacle'].to_numpy(dtype=bool),
+        'side': SIDES[side],
+        'open_odds': open_odds[rows, side],
+        'odds': odds[rows, side],
+        'drop': drop[rows, side],
+    }, index=pd.Index(df['match_link'].to_numpy(), name='match_link'))
+    return result[result['drop'] >= MIN_DROP]
+
+
+def rank(df, pinnacle_only):
+    # match_links of the TOP_K biggest drops of df
+    if pinnacle_only:
+        df = df[df['pinnacle']]
+    return df['drop'].nlargest(TOP_K).index.tolist()
+
+
+def merge(top, all_moves, changed_moves, changed_links, pinnacle_only):
+    # the ranking after a refresh: without a ranked match losing its place the new
+    # ranking is among the old one and the changed matches, otherwise it is taken again
+    # from the ranked unfinished matches
+    kept = [link for link in top if link not in changed_links]
+    if len(kept) < len(top):
+        return rank(all_moves, pinnacle_only)
+    candidates = changed_moves[changed_moves['pinnacle']] if pinnacle_only else changed_moves
+    drops = all_moves['drop']
+    return heapq.nlargest(TOP_K, kept + candidates.index.tolist(), key=drops.get)
+
+
+def unfinished(snapshot):
+    # unfinished rows of the whole archive, league by league for the sql backend
+    data = getattr(snapshot, 'data', None)
+    if data is not None:
+        return data[~data['finished']]
+    leagues = [
+        SOURCE.league_matches(country, league) for country in SOURCE.countries() for league in SOURCE.leagues(country)
+    ]
+    return pd.concat(leagues) if leagues else None
+
+
+def changed_rows(snapshot, changed):
+    # current versions of the changed matches, matches that left the archive have none;
+    # the sql backend only reports which matches changed
+    if getattr(snapshot, 'data', None) is not None:
+        positions = [snapshot.by_link.get(link) for link in changed['match_link'].unique()]
+        return snapshot.data.iloc[[pos for pos in positions if pos is not None]]
+    rows = [SOURCE.match(match_link) for match_link in changed['match_link'].unique()]
+    rows = [row for row in rows if row is not None]
+    return pd.DataFrame(rows) if rows else None
+
+
+def on_refresh(snapshot, changed):
+    global MOVES, TOP
+
+    with _LOCK:
+        if changed is None:
+            df = unfinished(snapshot)
+            MOVES = moves(df) if df is not None and not df.empty else NO_MOVES
+            TOP = {pinnacle_only: rank(MOVES, pinnacle_only) for pinnacle_only in TOP}
+            return
+
+        # finished matches leave the ranking, the drops of the others are taken again
+        links = set(changed['match_link'])
+        rows = changed_rows(snapshot, changed)
+        changed_moves = moves(rows) if rows is not None and not rows.empty else NO_MOVES
+        parts = [part for part in [MOVES[~MOVES.index.isin(links)], changed_moves] if not part.empty]
+        all_moves = pd.concat(parts) if parts else NO_MOVES
+        TOP = {
+            pinnacle_only: merge(top, all_moves, changed_moves, links, pinnacle_only) for pinnacle_only, top in TOP.items()
+        }
+        MOVES = all_moves
+
+
+def top_drops(pinnacle_only=False):
+    # ranked moves, biggest drop first
+    ranked, top = MOVES, TOP[pinnacle_only]
+    return ranked.loc[[link for link in top if link in ranked.index]]
+
+
+def attach(source):
+    # keep the ranking in step with the data backend the views are rendered from
+    global SOURCE
+
+    SOURCE = source
+    source.add_listener(on_refresh)
+    if source.current().version:
+        on_refresh(source.current(), None)
@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import logging
+import datetime as dt
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError: # snapshot cache is optional
+    pa = None
+    feather = None
+
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = './snapshots/odds_archive.feather'
+SNAPSHOT_FORMAT = 2 # bump when the store schema or the derived columns change
+MAX_AGE = dt.timedelta(days=2) # older snapshots are cheaper to reload than to catch up
+META_KEY = b'oddstab'
+
+# shared mode: one loader process publishes every snapshot into this directory (ideally
+# on tmpfs, e.g. /dev/shm/oddstab) and the web workers memory-map it instead of loading
+# odds_archive themselves
+SHARED_DIR = os.environ.get('ODDSTAB_SHARED_DIR')
+SHARED_POINTER = 'CURRENT'
+SHARED_KEEP = 3 # older versions are unlinked, workers still mapping them keep their pages
+INDEX_SUFFIX = '.index' # lookup indexes of a shared snapshot, next to its file
+
+
+def enabled():
+    # the local cache is replaced by the shared directory in shared mode
+    return feather is not None and bool(SNAPSHOT_PATH) and not SHARED_DIR
+
+
+def write(df, watermark):
+    if not enabled():
+        return False
+    return write_file(df, watermark, SNAPSHOT_PATH)
+
+
+def write_file(df, watermark, path):
+    meta = {
+        'format': SNAPSHOT_FORMAT,
+        'watermark': None if watermark is None else str(watermark),
+        'saved_at': dt.datetime.now().isoformat(),
+        'columns': list(df.columns),
+    }
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), META_KEY: json.dumps(meta).encode()})
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # uncompressed so the file can be memory-mapped, in one record batch so the columns don't
+        # have to be joined from chunks, renamed into place so readers never see a partial file
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        feather.write_feather(table, tmp_path, compression='uncompressed', chunksize=max(table.num_rows, 1))
+        os.replace(tmp_path, path)
+        return True
+    except Exception:
+        logger.exception('could not write odds_archive snapshot to %s', path)
+        return False
+
+
+def read_meta(path=None):
+    path = path or SNAPSHOT_PATH
+    schema = pa.ipc.open_file(pa.memory_map(path)).schema
+    return json.loads(schema.metadata[META_KEY])
+
+
+def is_stale(meta):
+    if meta.get('format') != SNAPSHOT_FORMAT:
+        return True
+    return dt.datetime.now() - dt.datetime.fromisoformat(meta['saved_at']) > MAX_AGE
+
+
+def read(path=None):
+    # (data, watermark) of a fresh snapshot on disk, None when there is nothing usable
+    if not enabled():
+        return None
+    return read_file(path or SNAPSHOT_PATH)
+
+
+def read_file(path, mapped_strings=False):
+    if not os.path.exists(path):
+        return None
+    try:
+        meta = read_meta(path)
+        if is_stale(meta):
+            logger.warning('ignoring stale odds_archive snapshot %s', path)
+            return None
+        # numeric columns without nulls stay backed by the mapped file, no copy; with
+        # mapped_strings the plain string columns too, as Arrow backed strings
+        types = {pa.string(): pd.StringDtype('pyarrow')} if mapped_strings else {}
+        df = feather.read_table(path, memory_map=True).to_pandas(split_blocks=True, types_mapper=types.get)
+    except Exception:
+        logger.exception('could not read odds_archive snapshot from %s', path)
+        return None
+
+    watermark = meta['watermark']
+    return df, None if watermark is None else pd.Timestamp(watermark).to_pydatetime()
+
+
+def shared_path():
+    # path of the snapshot the loader published last, None before the first one
+    try:
+        with open(os.path.join(SHARED_DIR, SHARED_POINTER)) as handle:
+            return json.loads(handle.read())['path']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def read_shared():
+    path = shared_path()
+    return None if path is None else read_file(path)
+
+
+def write_index(arrays, path):
+    # name -> array or list, written as a table of a single row of lists
+    try:
+        table = pa.table({name: pa.array([values]) for name, values in arrays.items()})
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        feather.write_feather(table, tmp_path, compression='uncompressed')
+        os.replace(tmp_path, path)
+        return True
+    except Exception:
+        logger.exception('could not write odds_archive indexes to %s', path)
+        return False
+
+
+def read_index(path):
+    # name -> array of the indexes shared with the snapshot at path, integers stay backed by
+    # the mapped file, the rest comes as lists; None when the loader didn't write them
+    path += INDEX_SUFFIX
+    if not os.path.exists(path):
+        return None
+    try:
+        table = feather.read_table(path, memory_map=True)
+    except Exception:
+        logger.exception('could not read odds_archive indexes from %s', path)
+        return None
+
+    arrays = {}
+    for name in table.column_names:
+        values = table[name].chunk(0).flatten()
+        arrays[name] = values.to_numpy() if pa.types.is_integer(values.type) else values.to_pylist()
+    return arrays
+
+
+def share(df, watermark, version, index=None):
+    os.makedirs(SHARED_DIR, exist_ok=True)
+    name = f'odds_archive-{int(time.time() * 1000)}-{version}.arrow'
+    path = os.path.join(SHARED_DIR, name)
+    # workers build the indexes themselves when they aren't there
+    if index is not None:
+        write_index(index, path + INDEX_SUFFIX)
+    if not write_file(df, watermark, path):
+        return None
+
+    # switch the pointer with a rename, workers see either the old or the new version
+    pointer = os.path.join(SHARED_DIR, SHARED_POINTER)
+    with open(f'{pointer}.tmp', 'w') as handle:
+        handle.write(json.dumps({'version': version, 'path': path}))
+    os.replace(f'{pointer}.tmp', pointer)
+
+    published = sorted(f for f in os.listdir(SHARED_DIR) if f.startswith('odds_archive-') and f.endswith('.arrow'))
+    for old in published[:-SHARED_KEEP]:
+        os.remove(os.path.join(SHARED_DIR, old))
+        if os.path.exists(os.path.join(SHARED_DIR, old + INDEX_SUFFIX)):
+            os.remove(os.path.join(SHARED_DIR, old + INDEX_SUFFIX))
+    return path
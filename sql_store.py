@@ -0,0 +1,253 @@
+import logging
+import threading
+import time
+import datetime as dt
+from collections import namedtuple
+
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+import metrics
+import store
+
+
+logger = logging.getLogger(__name__)
+
+# Alternative to the in-memory store for archives that don't fit in RAM: every view runs
+# a targeted, parameterized query. Needs migrations/001_odds_archive_indexes.sql.
+
+# tuned for many short indexed queries from the callback threads
+POOL_OPTIONS = {
+    'pool_size': 10,
+    'max_overflow': 10,
+    'pool_timeout': 10, # seconds to wait for a free connection
+    'pool_recycle': 1800, # seconds
+    'pool_pre_ping': True,
+    'connect_args': {'options': '-c statement_timeout=5000'}, # ms
+}
+
+# same slice of the archive the in-memory store loads
+ARCHIVE_FILTER = '(match_dt < date(now()) + 15 or home_odds is not null)'
+
+MATCH_SQL = text('''
+SELECT *
+FROM odds_archive
+WHERE match_link = :match_link
+''')
+
+TEAM_SQL = text(f'''
+SELECT *
+FROM odds_archive
+WHERE (home_id = :team_id or away_id = :team_id) and {ARCHIVE_FILTER}
+ORDER BY match_dt DESC
+LIMIT :limit OFFSET :offset
+''')
+
+TEAM_COUNT_SQL = text(f'''
+SELECT count(*)
+FROM odds_archive
+WHERE (home_id = :team_id or away_id = :team_id) and {ARCHIVE_FILTER}
+''')
+
+LEAGUE_SQL = text(f'''
+SELECT *
+FROM odds_archive
+WHERE country = :country and league = :league and finished = :finished and {ARCHIVE_FILTER}
+ORDER BY match_dt
+''')
+
+H2H_SQL = text(f'''
+SELECT *
+FROM odds_archive
+WHERE (home_id in (:team_id, :rival_id) or away_id in (:team_id, :rival_id)) and home_odds > 0 and {ARCHIVE_FILTER}
+''')
+
+COUNTRIES_SQL = text(f'''
+SELECT DISTINCT country
+FROM odds_archive
+WHERE {ARCHIVE_FILTER}
+''')
+
+LEAGUES_SQL = text(f'''
+SELECT DISTINCT league
+FROM odds_archive
+WHERE country = :country and {ARCHIVE_FILTER}
+''')
+
+# archive slice in kick-off order, the conditions of the given filters are appended
+EXPORT_SQL = f'''
+SELECT *
+FROM odds_archive
+WHERE {ARCHIVE_FILTER}{{filters}}
+ORDER BY match_dt
+'''
+
+EXPORT_FILTERS = {
+    'country': 'country = :country',
+    'league': 'league = :league',
+    'team_id': '(home_id = :team_id or away_id = :team_id)',
+    'start': 'match_dt >= :start',
+    'stop': 'match_dt < :stop',
+}
+
+WATERMARK_SQL = text('SELECT max(updated_at) FROM odds_archive')
+
+CHANGES_SQL = text('''
+SELECT match_link, home_id, away_id, league, updated_at
+FROM odds_archive
+WHERE updated_at > :watermark
+''')
+
+# there is no snapshot, the version only tracks changes seen in the database
+State = namedtuple('State', ['version', 'watermark', 'loaded_at'])
+
+STATE = State(0, None, None)
+ENGINE = None
+_LISTENERS = []
+_SEEN = {} # match_link -> updated_at of the rows the last check read, see store.REFRESH_LAG
+
+
+def create_pool(url):
+    return create_engine(url, **POOL_OPTIONS)
+
+
+def _read(sql, **params):
+    return store.prepare(pd.read_sql(sql, con=ENGINE, params=params))
+
+
+def _scalar(sql, **params):
+    with ENGINE.connect() as connection:
+        return connection.execute(sql, params).scalar()
+
+
+def current():
+    return STATE
+
+
+@metrics.timed('sql_store.match')
+def match(match_link):
+    df = _read(MATCH_SQL, match_link=match_link)
+    if df.empty:
+        return None
+    return df.iloc[0]
+
+
+@metrics.timed('sql_store.team_matches')
+def team_matches(team_id, start=None, stop=None):
+    # latest first, start/stop select a page of the team history
+    offset = start or 0
+    limit = None if stop is None else stop - offset
+    return _read(TEAM_SQL, team_id=team_id, limit=limit, offset=offset)
+
+
+@metrics.timed('sql_store.team_match_count')
+def team_match_count(team_id):
+    return _scalar(TEAM_COUNT_SQL, team_id=team_id)
+
+
+@metrics.timed('sql_store.league_matches')
+def league_matches(country, league, finished=False):
+    return _read(LEAGUE_SQL, country=country, league=league, finished=finished)
+
+
+@metrics.timed('sql_store.h2h_matches')
+def h2h_matches(team_id, rival_id, last_n=4):
+    # only both teams' matches leave the database, the blocks are cut the same way as in memory
+    df = _read(H2H_SQL, team_id=team_id, rival_id=rival_id)
+    metrics.scanned(len(df))
+    by_opponent = store.build_indexes(df)[-1]
+    return store.h2h_blocks(df, by_opponent, team_id, rival_id, last_n)
+
+
+@metrics.timed('sql_store.countries')
+def countries():
+    return sorted(pd.read_sql(COUNTRIES_SQL, con=ENGINE)['country'])
+
+
+@metrics.timed('sql_store.leagues')
+def leagues(country):
+    return sorted(pd.read_sql(LEAGUES_SQL, con=ENGINE, params={'country': country})['league'])
+
+
+def archive_slice(country=None, league=None, team_id=None, start=None, stop=None, chunk_rows=store.EXPORT_CHUNK_ROWS):
+    # same contract as store.archive_slice, read through a server-side cursor so
+    # only one chunk is held at a time
+    params = {'country': country, 'league': league, 'team_id': team_id, 'start': start, 'stop': stop}
+    params = {name: value for name, value in params.items() if value is not None}
+    sql = EXPORT_SQL.format(filters=''.join(f' and {EXPORT_FILTERS[name]}' for name in params))
+    with ENGINE.connect() as connection:
+        connection = connection.execution_options(stream_results=True)
+        for chunk in pd.read_sql(text(sql), con=connection, params=params, chunksize=chunk_rows):
+            yield store.prepare(chunk)
+
+
+def add_listener(listener):
+    # same contract as store.add_listener
+    _LISTENERS.append(listener)
+
+
+def _publish(watermark, changed):
+    global STATE
+
+    STATE = State(STATE.version + 1, watermark, dt.datetime.now())
+    for listener in _LISTENERS:
+        try:
+            listener(STATE, changed)
+        except Exception:
+            logger.exception('odds_archive change listener failed')
+
+
+def _recent():
+    # rows updated after the watermark or in the overlap below it, every row when the archive
+    # was empty so far (updated_at > NULL holds for none)
+    watermark = dt.datetime.min if STATE.watermark is None else STATE.watermark - store.REFRESH_LAG
+    changed = pd.read_sql(CHANGES_SQL, con=ENGINE, params={'watermark': watermark})
+    changed['updated_at'] = pd.to_datetime(changed['updated_at'])
+    return changed
+
+
+@metrics.timed('sql_store.watch')
+def watch():
+    # nothing is loaded, but the rendered views of changed teams and leagues still go stale
+    global _SEEN
+
+    if STATE.loaded_at is not None and STATE.loaded_at.date() != dt.date.today():
+        # fixtures entered the archive filter with the new day, every view may have changed
+        _publish(STATE.watermark, None)
+        return STATE
+
+    # rows of the overlap below the watermark are only changes when they weren't seen before
+    changed = _recent()
+    seen, _SEEN = _SEEN, dict(zip(changed['match_link'], changed['updated_at']))
+    new = [seen.get(link) != updated_at for link, updated_at in zip(changed['match_link'], changed['updated_at'])]
+    changed = changed[new]
+    if changed.empty:
+        return STATE
+    changed = changed.assign(country=changed['match_link'].str.extract(r'soccer/([^/]*)/', expand=False))
+    latest = changed['updated_at'].max().to_pydatetime()
+    # no watermark yet when the archive was empty at start
+    _publish(latest if STATE.watermark is None else max(STATE.watermark, latest), changed)
+    return STATE
+
+
+def _watch_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            watch()
+        except Exception:
+            logger.exception('odds_archive change check failed')
+
+
+def start(engine, interval=store.REFRESH_INTERVAL):
+    global ENGINE, _SEEN
+
+    ENGINE = engine
+    watermark = _scalar(WATERMARK_SQL)
+    # plain datetime whatever the driver returns, the watermark is lowered by REFRESH_LAG
+    _publish(None if watermark is None else pd.Timestamp(watermark).to_pydatetime(), None)
+    recent = _recent()
+    _SEEN = dict(zip(recent['match_link'], recent['updated_at']))
+    thread = threading.Thread(target=_watch_loop, args=(interval,), name='odds-watcher', daemon=True)
+    thread.start()
+    return thread
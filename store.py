@@ -0,0 +1,580 @@
+import logging
+import threading
+import time
+import datetime as dt
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import margin
+import metrics
+import snapshots
+
+
+logger = logging.getLogger(__name__)
+
+LOAD_SQL = '''
+SELECT *
+FROM odds_archive
+WHERE match_dt < date(now()) + 15 or home_odds is not null
+'''
+
+# rows changed since the last watermark: new matches, updated odds, finished scores
+# (archives without an updated_at column fall back to a full reload on every refresh).
+# The watermark passed in is lowered by REFRESH_LAG, see refresh
+DELTA_SQL = '''
+SELECT *
+FROM odds_archive
+WHERE (match_dt < date(now()) + 15 or home_odds is not null)
+  and updated_at > :watermark
+'''
+
+WATERMARK_COL = 'updated_at'
+TRUE_ODDS_METHOD = 'shin' # one of margin.METHODS
+REFRESH_INTERVAL = 60 # seconds
+# rows are stamped when their transaction writes them, not when it commits: every refresh reads
+# again this far below the watermark, so rows committed late are still picked up
+REFRESH_LAG = dt.timedelta(minutes=10)
+# fixtures enter the archive filter as the date moves on without being updated, so the archive
+# is loaded fully again at the first refresh of every day and at least this often
+FULL_RELOAD_INTERVAL = dt.timedelta(hours=6)
+EXPORT_CHUNK_ROWS = 20000 # rows per chunk of an archive slice
+# the local snapshot is written after every full load, after delta refreshes at most this often
+SAVE_INTERVAL = dt.timedelta(minutes=30)
+ATTACH_INTERVAL = 1 # seconds between checks for a new shared snapshot in worker processes
+
+# immutable view of the archive with its lookup indexes, replaced as a whole on every refresh
+Snapshot = namedtuple(
+    'Snapshot', ['data', 'version', 'watermark', 'loaded_at', 'by_link', 'by_team', 'by_league', 'by_opponent']
+)
+
+SNAPSHOT = Snapshot(pd.DataFrame(), 0, None, None, {}, {}, {}, {})
+NO_MATCHES = np.array([], dtype=int)
+
+OUTCOMES = ['home', 'draw', 'away']
+
+# compact in-memory types: repeated strings as categoricals, odds as float32
+SCHEMA = {
+    'country': 'category',
+    'league': 'category',
+    'home_id': 'category',
+    'away_id': 'category',
+    'home_name': 'category',
+    'away_name': 'category',
+    'match': 'category',
+    'match_outcome': 'category',
+    'home_goals': 'Int16',
+    'away_goals': 'Int16',
+    'finished': 'bool',
+    'pinnacle': 'bool',
+}
+for side in ['home', 'draw', 'away']:
+    for odds in ['odds', 'open_odds', 'true_odds', 'true_open_odds']:
+        SCHEMA[f'{side}_{odds}'] = 'float32'
+_REFRESH_LOCK = threading.Lock()
+_LISTENERS = []
+_FULL_LOAD_AT = None # time of the last full load, or of the cached snapshot served instead
+_SAVED_AT = None # time the local snapshot was last written
+
+
+def apply_schema(df):
+    for col, dtype in SCHEMA.items():
+        if dtype == 'bool':
+            df[col] = df[col].fillna(False).astype(bool)
+        elif dtype == 'float32':
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float32')
+        else:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def enrich(df):
+    # columns the views show as they are, derived once for every loaded or changed row
+    df['country'] = df['match_link'].str.extract(r'soccer/([^/]*)/', expand=False)
+    df['match'] = df['home_name'] + ' vs ' + df['away_name']
+    df['date_link'] = '**[' + df['match_dt'].dt.strftime('%d.%m.%Y') + '](' + df['match_link'] + ')**'
+
+    # goals as numbers, '-:-' and other unplayed scores stay empty
+    goals = df['final_score'].astype(str).str.extract(r'^\s*(\d+)\s*:\s*(\d+)\s*$').apply(pd.to_numeric)
+    df['home_goals'], df['away_goals'] = goals[0], goals[1]
+    outcome = np.select([goals[0] > goals[1], goals[0] < goals[1], goals[0] == goals[1]], ['home', 'away', 'draw'], '')
+    df['match_outcome'] = pd.Categorical(outcome, categories=OUTCOMES)
+    return df
+
+
+def prepare(df):
+    df['match_dt'] = pd.to_datetime(df['match_dt'])
+    if WATERMARK_COL in df.columns:
+        df[WATERMARK_COL] = pd.to_datetime(df[WATERMARK_COL])
+    df = enrich(df)
+
+    # odds without bookmaker margin, computed once for every loaded or changed row
+    for odds in ['odds', 'open_odds']:
+        cols = [f'{side}_{odds}' for side in ['home', 'draw', 'away']]
+        prices = df[cols].apply(pd.to_numeric, errors='coerce').values
+        df[[f'{side}_true_{odds}' for side in ['home', 'draw', 'away']]] = margin.true_odds(prices, TRUE_ODDS_METHOD)
+    return apply_schema(df)
+
+
+def build_indexes(df):
+    positions = np.arange(len(df))
+    match_dt = df['match_dt'].values
+
+    # match_link -> row position
+    by_link = dict(zip(df['match_link'], positions))
+
+    # team_id -> row positions of all its matches, latest first
+    teams = pd.DataFrame({
+        'team_id': np.concatenate([np.asarray(df['home_id']), np.asarray(df['away_id'])]),
+        'opponent_id': np.concatenate([np.asarray(df['away_id']), np.asarray(df['home_id'])]),
+        'match_dt': np.concatenate([match_dt, match_dt]),
+        'pos': np.concatenate([positions, positions]),
+    }).sort_values('match_dt', ascending=False, kind='mergesort')
+    team_pos = teams['pos'].values
+    by_team = {team_id: team_pos[ixs] for team_id, ixs in teams.groupby('team_id', sort=False).indices.items()}
+
+    # team_id -> opponent_id -> row positions of their meetings, latest first
+    by_opponent = {}
+    for (team_id, opponent_id), ixs in teams.groupby(['team_id', 'opponent_id'], sort=False).indices.items():
+        by_opponent.setdefault(team_id, {})[opponent_id] = team_pos[ixs]
+
+    # (country, league, finished) -> row positions, earliest first
+    order = match_dt.argsort(kind='mergesort')
+    leagues = df.iloc[order]
+    by_league = {
+        key: order[ixs] for key, ixs in leagues.groupby(['country', 'league', 'finished'], sort=False, observed=True).indices.items()
+    }
+    return by_link, by_team, by_league, by_opponent
+
+
+def link_hashes(links):
+    # the same in every process, unlike hash()
+    return pd.util.hash_array(np.asarray(links, dtype=object), categorize=False)
+
+
+class LinkIndex:
+    # match_link -> row position of a snapshot attached from a shared file, looked up
+    # through the sorted link hashes mapped from its index file instead of a dict
+
+    def __init__(self, links, hashes, positions):
+        self.links = links
+        self.hashes = hashes
+        self.positions = positions
+
+    def get(self, match_link, default=None):
+        key = link_hashes([match_link])[0]
+        start, stop = self.hashes.searchsorted(key), self.hashes.searchsorted(key, 'right')
+        for pos in self.positions[start:stop]:
+            if self.links[pos] == match_link:
+                return pos
+        return default
+
+    def __getitem__(self, match_link):
+        pos = self.get(match_link)
+        if pos is None:
+            raise KeyError(match_link)
+        return pos
+
+    def __contains__(self, match_link):
+        return self.get(match_link) is not None
+
+    def __len__(self):
+        return len(self.positions)
+
+
+class OpponentIndex:
+    # team_id -> opponent_id -> row positions of a snapshot attached from a shared file,
+    # the opponents of a team are only put in a dict when it is looked up
+
+    def __init__(self, teams, team_offsets, opponents, offsets, positions):
+        self.teams = teams
+        self.codes = {team_id: code for code, team_id in enumerate(teams)}
+        self.team_offsets = team_offsets
+        self.opponents = opponents
+        self.offsets = offsets
+        self.positions = positions
+
+    def get(self, team_id, default=None):
+        code = self.codes.get(team_id)
+        if code is None:
+            return default
+        pairs = range(self.team_offsets[code], self.team_offsets[code + 1])
+        return {
+            self.teams[self.opponents[pair]]: self.positions[self.offsets[pair]:self.offsets[pair + 1]] for pair in pairs
+        }
+
+
+def _flatten(groups):
+    # offsets into the positions of all groups one after the other
+    groups = list(groups)
+    offsets = np.cumsum([0] + [len(positions) for positions in groups])
+    return offsets, np.concatenate(groups) if groups else NO_MATCHES
+
+
+def _groups(keys, offsets, positions):
+    return {key: positions[offsets[ix]:offsets[ix + 1]] for ix, key in enumerate(keys)}
+
+
+def pack_indexes(snapshot):
+    # the indexes of snapshot as flat arrays, for the workers of shared mode
+    by_link, by_team, by_league, by_opponent = snapshot[4:]
+    hashes = link_hashes(snapshot.data['match_link'])
+    order = hashes.argsort(kind='mergesort')
+    teams = list(by_team)
+    codes = {team_id: code for code, team_id in enumerate(teams)}
+    leagues = list(by_league)
+    team_offsets, team_pos = _flatten(by_team[team_id] for team_id in teams)
+    league_offsets, league_pos = _flatten(by_league[key] for key in leagues)
+    opponent_offsets, opponent_pos = _flatten(ixs for team_id in teams for ixs in by_opponent[team_id].values())
+    return {
+        'link_hash': hashes[order],
+        'link_pos': order,
+        'team': teams,
+        'team_offsets': team_offsets,
+        'team_pos': team_pos,
+        'league_country': [country for country, _, _ in leagues],
+        'league_name': [league for _, league, _ in leagues],
+        'league_finished': [bool(finished) for _, _, finished in leagues],
+        'league_offsets': league_offsets,
+        'league_pos': league_pos,
+        'opponent_team_offsets': np.cumsum([0] + [len(by_opponent[team_id]) for team_id in teams]),
+        'opponent': [codes[opponent_id] for team_id in teams for opponent_id in by_opponent[team_id]],
+        'opponent_offsets': opponent_offsets,
+        'opponent_pos': opponent_pos,
+    }
+
+
+def unpack_indexes(df, arrays):
+    # indexes of df from the arrays pack_indexes made, positions are not copied
+    leagues = zip(arrays['league_country'], arrays['league_name'], arrays['league_finished'])
+    return (
+        LinkIndex(df['match_link'].array, arrays['link_hash'], arrays['link_pos']),
+        _groups(arrays['team'], arrays['team_offsets'], arrays['team_pos']),
+        _groups(list(leagues), arrays['league_offsets'], arrays['league_pos']),
+        OpponentIndex(
+            arrays['team'], arrays['opponent_team_offsets'], arrays['opponent'], arrays['opponent_offsets'],
+            arrays['opponent_pos'],
+        ),
+    )
+
+
+def current():
+    return SNAPSHOT
+
+
+def data():
+    return SNAPSHOT.data
+
+
+@metrics.timed('store.match')
+def match(match_link):
+    snapshot = SNAPSHOT
+    pos = snapshot.by_link.get(match_link)
+    if pos is None:
+        return None
+    return snapshot.data.iloc[pos]
+
+
+@metrics.timed('store.team_matches')
+def team_matches(team_id, start=None, stop=None):
+    # latest first, start/stop select a page of the team history
+    snapshot = SNAPSHOT
+    return snapshot.data.iloc[snapshot.by_team.get(team_id, NO_MATCHES)[start:stop]]
+
+
+@metrics.timed('store.team_match_count')
+def team_match_count(team_id):
+    return len(SNAPSHOT.by_team.get(team_id, NO_MATCHES))
+
+
+@metrics.timed('store.league_matches')
+def league_matches(country, league, finished=False):
+    snapshot = SNAPSHOT
+    return snapshot.data.iloc[snapshot.by_league.get((country, league, finished), [])]
+
+
+def archive_slice(country=None, league=None, team_id=None, start=None, stop=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    # rows of the snapshot in kick-off order, chunk_rows at a time, start and stop bound
+    # match_dt; only the row positions are selected up front, the rows are copied per chunk
+    snapshot = SNAPSHOT
+    data = snapshot.data
+    if team_id is not None:
+        positions = snapshot.by_team.get(team_id, NO_MATCHES)
+    elif country is not None or league is not None:
+        positions = [ixs for (c, l, _), ixs in snapshot.by_league.items() if country in (None, c) and league in (None, l)]
+        positions = np.concatenate(positions) if positions else NO_MATCHES
+    else:
+        positions = np.arange(len(data))
+
+    keep = np.ones(len(positions), dtype=bool)
+    if team_id is not None:
+        for col, value in [('country', country), ('league', league)]:
+            if value is not None:
+                keep &= (data[col].iloc[positions] == value).to_numpy()
+    match_dt = data['match_dt'].to_numpy()[positions] if len(data) else np.array([], dtype='datetime64[ns]')
+    if start is not None:
+        keep &= match_dt >= np.datetime64(pd.Timestamp(start))
+    if stop is not None:
+        keep &= match_dt < np.datetime64(pd.Timestamp(stop))
+    positions = positions[keep][match_dt[keep].argsort(kind='mergesort')]
+
+    for ix in range(0, len(positions), chunk_rows):
+        yield data.iloc[positions[ix:ix + chunk_rows]]
+
+
+def h2h_blocks(df, by_opponent, team_id, rival_id, last_n=4):
+    # direct meetings followed by the last_n meetings with
+    # every common opponent, only matches with odds, latest opponents first
+    home_odds = df['home_odds'].values
+    match_dt = df['match_dt'].values
+    team_opponents = by_opponent.get(team_id, {})
+    rival_opponents = by_opponent.get(rival_id, {})
+
+    def with_odds(positions):
+        return positions[home_odds[positions] > 0]
+
+    common = []
+    for opponent_id in (team_opponents.keys() & rival_opponents.keys()) - {team_id, rival_id}:
+        team_pos = with_odds(team_opponents[opponent_id])
+        rival_pos = with_odds(rival_opponents[opponent_id])
+        if len(team_pos) == 0 or len(rival_pos) == 0:
+            continue
+        positions = np.concatenate([team_pos, rival_pos])
+        positions = positions[match_dt[positions].argsort(kind='mergesort')[::-1]]
+        common.append((match_dt[positions[0]], positions[:last_n]))
+
+    common.sort(key=lambda meetings: meetings[0], reverse=True)
+    blocks = [with_odds(team_opponents.get(rival_id, NO_MATCHES))] + [positions for _, positions in common]
+    return [df.iloc[positions] for positions in blocks]
+
+
+@metrics.timed('store.h2h_matches')
+def h2h_matches(team_id, rival_id, last_n=4):
+    snapshot = SNAPSHOT
+    # the meetings are picked from all matches of both teams, as the sql backend reads them
+    teams = sum(len(snapshot.by_team.get(team, NO_MATCHES)) for team in [team_id, rival_id])
+    metrics.scanned(teams - len(snapshot.by_opponent.get(team_id, {}).get(rival_id, NO_MATCHES)))
+    return h2h_blocks(snapshot.data, snapshot.by_opponent, team_id, rival_id, last_n)
+
+
+@metrics.timed('store.countries')
+def countries():
+    return sorted({country for country, _, _ in SNAPSHOT.by_league})
+
+
+@metrics.timed('store.leagues')
+def leagues(country):
+    return sorted({league for c, league, _ in SNAPSHOT.by_league if c == country})
+
+
+def _watermark(df):
+    if WATERMARK_COL not in df.columns or df.empty:
+        return None
+    watermark = df[WATERMARK_COL].max()
+    # plain datetime, so every DB driver can bind it as a query parameter
+    return watermark.to_pydatetime() if isinstance(watermark, pd.Timestamp) else watermark
+
+
+def add_listener(listener):
+    # listener(snapshot, changed) runs after every publish, changed holds the old and new
+    # versions of the rows a delta refresh touched, None after a full load
+    _LISTENERS.append(listener)
+
+
+def _notify(snapshot, changed):
+    for listener in _LISTENERS:
+        try:
+            listener(snapshot, changed)
+        except Exception:
+            logger.exception('odds_archive refresh listener failed')
+
+
+def _publish(df, watermark, changed=None, indexes=None):
+    global SNAPSHOT
+
+    # indexes are rebuilt before the swap; a single reference assignment means
+    # readers get either the old or the new snapshot, never a mix of both
+    indexes = indexes or build_indexes(df)
+    SNAPSHOT = Snapshot(df, SNAPSHOT.version + 1, watermark, dt.datetime.now(), *indexes)
+    _notify(SNAPSHOT, changed)
+    return SNAPSHOT
+
+
+def _save(snapshot, full=True):
+    # keep the local columnar copy close to the served snapshot, for fast restarts; a restart
+    # catches up from the watermark of the copy, so delta refreshes don't rewrite it every time
+    global _SAVED_AT
+
+    now = dt.datetime.now()
+    if full or _SAVED_AT is None or now - _SAVED_AT > SAVE_INTERVAL:
+        _SAVED_AT = now
+        snapshots.write(snapshot.data, snapshot.watermark)
+    return snapshot
+
+
+@metrics.timed('store.load')
+def load(engine):
+    global _FULL_LOAD_AT
+
+    with _REFRESH_LOCK:
+        df = prepare(pd.read_sql(text(LOAD_SQL), con=engine))
+        _FULL_LOAD_AT = dt.datetime.now()
+        snapshot = _publish(df, _watermark(df))
+    # written outside the lock, readers of the snapshot don't wait for the file
+    return _save(snapshot)
+
+
+def _publish_cached(cached):
+    # serve a snapshot read from disk, it counts as a full load until the next one is due
+    global _FULL_LOAD_AT
+
+    with _REFRESH_LOCK:
+        _FULL_LOAD_AT = dt.datetime.now()
+        return _publish(*cached)
+
+
+def _full_load_due():
+    now = dt.datetime.now()
+    return _FULL_LOAD_AT is None or _FULL_LOAD_AT.date() != now.date() or now - _FULL_LOAD_AT > FULL_RELOAD_INTERVAL
+
+
+def unseen(df, delta):
+    # rows of delta that df doesn't hold at the same updated_at: rows read again from the
+    # overlap below the watermark are dropped unless they changed since
+    delta = delta.drop_duplicates('match_link', keep='last')
+    held = df[df['match_link'].isin(delta['match_link'])]
+    held = pd.Series(held[WATERMARK_COL].to_numpy(), index=held['match_link'].to_numpy())
+    known = delta['match_link'].map(held)
+    return delta[(known.isna() | (known != delta[WATERMARK_COL])).to_numpy()]
+
+
+def merge(df, delta):
+    # changed rows replace their previous version, new rows are appended
+    kept = df[~df['match_link'].isin(delta['match_link'])]
+    # categories of the two parts differ, so the merged frame is compacted again
+    return apply_schema(pd.concat([kept, delta], ignore_index=True))
+
+
+@metrics.timed('store.refresh')
+def refresh(engine):
+    snapshot = SNAPSHOT
+    if snapshot.watermark is None or _full_load_due():
+        # no watermark column in the archive to diff against, or the archive filter moved
+        return load(engine)
+
+    with _REFRESH_LOCK:
+        delta = pd.read_sql(text(DELTA_SQL), con=engine, params={'watermark': snapshot.watermark - REFRESH_LAG})
+        if delta.empty:
+            return snapshot
+        delta = unseen(snapshot.data, prepare(delta))
+        if delta.empty:
+            return snapshot
+        df = merge(snapshot.data, delta)
+        changed = pd.concat([snapshot.data[snapshot.data['match_link'].isin(delta['match_link'])], delta])
+        snapshot = _publish(df, max(snapshot.watermark, _watermark(delta)), changed)
+    return _save(snapshot, full=False)
+
+
+def _refresh_loop(engine, interval, catch_up):
+    while True:
+        if not catch_up:
+            time.sleep(interval)
+        catch_up = False
+        try:
+            refresh(engine)
+        except Exception:
+            logger.exception('odds_archive refresh failed')
+
+
+def start_refresher(engine, interval=REFRESH_INTERVAL, catch_up=False):
+    thread = threading.Thread(
+        target=_refresh_loop, args=(engine, interval, catch_up), name='odds-refresher', daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def start(engine, interval=REFRESH_INTERVAL):
+    # serve from the local snapshot right away when there is one and catch up with
+    # the database in the background, otherwise block on the first full load
+    cached = snapshots.read()
+    if cached is None:
+        load(engine)
+    else:
+        _publish_cached(cached)
+    return start_refresher(engine, interval, catch_up=cached is not None)
+
+
+def _share(snapshot, changed):
+    snapshots.share(snapshot.data, snapshot.watermark, snapshot.version, pack_indexes(snapshot))
+
+
+def run_loader(engine, interval=REFRESH_INTERVAL):
+    # shared mode: the only process that reads odds_archive, every snapshot it
+    # publishes is written to snapshots.SHARED_DIR for the web workers
+    if snapshots.feather is None:
+        raise RuntimeError('shared snapshots need pyarrow')
+    add_listener(_share)
+    cached = snapshots.read_shared()
+    if cached is None:
+        load(engine)
+    else:
+        _publish_cached(cached)
+    _refresh_loop(engine, interval, catch_up=cached is not None)
+
+
+def _changed_since(snapshot, df):
+    # rows a loader refresh touched: rows of the overlap below the old watermark that changed,
+    # as refresh finds them, and rows that entered or left with a full reload of the loader
+    if snapshot.watermark is None or WATERMARK_COL not in df.columns:
+        return None
+    old = snapshot.data
+    # links compared as plain strings, isin of Arrow backed strings goes value by value
+    old_links, links = (pd.Index(frame['match_link'].to_numpy(dtype=object)) for frame in [old, df])
+    delta = unseen(old, df[df[WATERMARK_COL] > snapshot.watermark - REFRESH_LAG])
+    entered = df[~links.isin(old_links)]
+    left = old[~old_links.isin(links)]
+    delta = pd.concat([delta, entered]).drop_duplicates('match_link')
+    return pd.concat([old[old_links.isin(delta['match_link'])], left, delta])
+
+
+@metrics.timed('store.attach')
+def _attach(path):
+    # strings and index positions stay in the mapped files
+    attached = snapshots.read_file(path, mapped_strings=True)
+    if attached is None:
+        return False
+    df, watermark = attached
+    arrays = snapshots.read_index(path)
+    indexes = None if arrays is None else unpack_indexes(df, arrays)
+    with _REFRESH_LOCK:
+        _publish(df, watermark, _changed_since(SNAPSHOT, df) if SNAPSHOT.version else None, indexes)
+    return True
+
+
+def _attach_loop(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            shared_path = snapshots.shared_path()
+            if shared_path is not None and shared_path != path and _attach(shared_path):
+                path = shared_path
+        except Exception:
+            logger.exception('attaching to shared odds_archive snapshot failed')
+
+
+def start_worker(interval=ATTACH_INTERVAL):
+    # shared mode: wait for the loader's first snapshot, then follow its new versions
+    if snapshots.feather is None:
+        raise RuntimeError('shared snapshots need pyarrow')
+    path = snapshots.shared_path()
+    while path is None or not _attach(path):
+        logger.warning('waiting for a shared odds_archive snapshot in %s', snapshots.SHARED_DIR)
+        time.sleep(interval)
+        path = snapshots.shared_path()
+
+    thread = threading.Thread(target=_attach_loop, args=(path, interval), name='odds-attacher', daemon=True)
+    thread.start()
+    return thread
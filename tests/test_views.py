@@ -0,0 +1,40 @@
+import pandas as pd
+import pytest
+
+import store
+import views
+from bench import synthetic
+
+
+UNPRICED = ['home_odds', 'draw_odds', 'away_odds', 'home_open_odds', 'draw_open_odds', 'away_open_odds']
+
+
+@pytest.fixture(scope='module')
+def archive():
+    # small synthetic archive with a league whose matches are all played and a fixture
+    # between two teams without any other matches, and no odds
+    df = synthetic.generate(**synthetic.SIZES['small'])
+    played = (df['country'] == 'country0') & (df['league'] == 'league-2')
+    df.loc[played, 'finished'] = True
+    fixture = df.iloc[[0]].assign(
+        match_link='https://www.oddsportal.com/soccer/country0/league-1/new-a-new-b-0/',
+        home_id='new-a', away_id='new-b', home_name='New A', away_name='New B',
+        match_dt=pd.Timestamp.today().normalize() + pd.Timedelta(days=3), finished=False, final_score='-:-',
+    )
+    fixture[UNPRICED] = None
+    df = pd.concat([df, fixture], ignore_index=True)
+    store._publish(store.prepare(df), None)
+    views.use(store)
+    return fixture.iloc[0]
+
+
+def test_league_without_upcoming_matches(archive):
+    data, tooltips, _ = views.league_odds_tab('country0', 'league-2')
+    assert data == [] and tooltips == []
+
+
+def test_h2h_without_priced_meetings(archive):
+    data, tooltips, _, rows = views.create_h2h_tab(archive['match_link'])
+    assert rows == 1
+    assert [row['separator'] for row in data] == [1]
+    assert tooltips == [{'home_odds': None, 'draw_odds': None, 'away_odds': None}]
@@ -0,0 +1,397 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+import store
+import form
+import backtest
+import odds_history
+import scanner
+import render_cache
+import metrics
+from render_cache import league_tag, team_tag
+
+
+# data backend the tables are built from, store or sql_store
+STORE = store
+
+ODDS_COLS = ['home_odds', 'draw_odds', 'away_odds']
+OPEN_ODDS_COLS = ['home_open_odds', 'draw_open_odds', 'away_open_odds']
+TRUE_ODDS_COLS = ['home_true_odds', 'draw_true_odds', 'away_true_odds']
+TRUE_OPEN_ODDS_COLS = ['home_true_open_odds', 'draw_true_open_odds', 'away_true_open_odds']
+
+# colors of the table cells
+STRIPE_COLORS = {'even': 'rgb(248, 248, 248)', 'odd': 'rgb(255, 255, 255)'}
+SELECTED_COLOR = 'rgb(204, 255, 255)'
+WIN_ODDS_COLOR = 'rgb(255, 255, 204)'
+NOT_PINNACLE_COLOR = 'rgb(192, 192, 192)'
+RESULT_COLORS = {'win': 'rgb(102,255,102)', 'draw': 'rgb(255,165,0)', 'loss': 'rgb(255,51,51)'}
+
+# hidden data columns shipped with team and h2h rows for the style rules
+MATCH_STYLE_COLS = ['selected', 'home_team', 'away_team', 'pinnacle', 'match_outcome']
+
+PAGE_SIZE = 50 # rows per page of the team and h2h tables
+
+TOP_COUNTRIES = [
+    'england',
+    'spain',
+    'italy',
+    'france',
+    'germany',
+    'turkey',
+    'europe'
+]
+
+_NAV = None # nav_index of the current data version
+
+def table_rows(table):
+    # rows of a (data, tooltip_data, style) table
+    return len(table[0])
+
+
+def stripe_rows(**style):
+    return [{'if': {'row_index': ix}, 'backgroundColor': color, **style} for ix, color in STRIPE_COLORS.items()]
+
+
+def league_style_rules():
+    rules = stripe_rows(padding='2px 4px', fontSize=15, fontWeight='normal')
+    for col in ['home_name', 'away_name']:
+        rules.append({'if': {'column_id': col}, 'fontWeight': 'bold'})
+    for col in ['total', 'handicap']:
+        rules.append({'if': {'column_id': col}, 'padding': '2px 12px', 'fontSize': 14})
+    return rules
+
+
+def matches_style_rules(result_col):
+    # rules are evaluated by the table against the hidden MATCH_STYLE_COLS of every row,
+    # later rules override earlier ones
+    rules = stripe_rows(color='rgb(0, 0, 0)', padding='1px 1px', fontSize=14, fontWeight='normal')
+    rules += [
+        {'if': {'filter_query': '{selected} = 1'}, 'backgroundColor': SELECTED_COLOR},
+        {'if': {'column_id': 'league'}, 'fontSize': 13},
+        {'if': {'column_id': 'total'}, 'fontSize': 13},
+        {'if': {'column_id': 'final_score'}, 'fontSize': 15, 'fontWeight': 'bold', 'padding': '1px 3px'},
+        {'if': {'column_id': 'away_odds'}, 'padding': '1px 3px'},
+        {'if': {'column_id': 'home_name', 'filter_query': '{home_team} = 1'}, 'fontWeight': 'bold'},
+        {'if': {'column_id': 'away_name', 'filter_query': '{away_team} = 1'}, 'fontWeight': 'bold'},
+    ]
+    # applies only for finished matches
+    for side in ['home', 'draw', 'away']:
+        rules.append(
+            {'if': {'column_id': f'{side}_odds', 'filter_query': f'{{match_outcome}} = "{side}"'}, 'backgroundColor': WIN_ODDS_COLOR}
+        )
+    # gray font for not pinnacle odds
+    for col in ODDS_COLS:
+        rules.append({'if': {'column_id': col, 'filter_query': '{pinnacle} = 0'}, 'color': NOT_PINNACLE_COLOR})
+
+    if result_col:
+        for result, color in RESULT_COLORS.items():
+            rules.append(
+                {'if': {'column_id': 'result', 'filter_query': f'{{team_result}} = "{result}"'}, 'backgroundColor': color, 'padding': '1px 3px'}
+            )
+    else:
+        rules.append({'if': {'filter_query': '{separator} = 1'}, 'backgroundColor': 'rgb(255, 255, 255)'})
+    return rules
+
+
+LEAGUE_STYLE = league_style_rules()
+TEAM_STYLE = matches_style_rules(result_col=True)
+H2H_STYLE = matches_style_rules(result_col=False)
+BACKTEST_STYLE = stripe_rows(padding='2px 8px', fontSize=14, fontWeight='normal') + [
+    {'if': {'filter_query': '{season} = "All"'}, 'fontWeight': 'bold'},
+    {'if': {'column_id': 'profit', 'filter_query': '{profit} < 0'}, 'color': RESULT_COLORS['loss']},
+]
+
+SCANNER_STYLE = stripe_rows(padding='2px 8px', fontSize=14, fontWeight='normal') + [
+    {'if': {'column_id': col}, 'fontWeight': 'bold'} for col in ['home_name', 'away_name', 'drop']
+] + [
+    {'if': {'column_id': col, 'filter_query': '{pinnacle} = 0'}, 'color': NOT_PINNACLE_COLOR} for col in ['open_odds', 'odds']
+]
+
+
+def format_odds(df):
+    # odds as 2 decimal strings with change direction symbol against open odds, all sides at once
+    odds = df[ODDS_COLS].apply(pd.to_numeric, errors='coerce').values
+    open_odds = df[OPEN_ODDS_COLS].apply(pd.to_numeric, errors='coerce').values
+
+    valid = odds > 0
+    rounded = odds.round(2)
+    # np.char.mod flattens an empty array, reshaped so frames without rows keep their 3 columns
+    text = np.where(valid, np.char.mod('%.2f', np.nan_to_num(odds)).reshape(odds.shape), '-')
+    direction = np.select([valid & (rounded > open_odds), valid & (open_odds > rounded)], ['🎄', '🔻'], '')
+    return pd.DataFrame(np.char.add(direction, text).astype(object), index=df.index, columns=ODDS_COLS)
+
+
+def with_true_odds(df):
+    # show odds without bookmaker margin in place of the quoted ones
+    df[ODDS_COLS + OPEN_ODDS_COLS] = df[TRUE_ODDS_COLS + TRUE_OPEN_ODDS_COLS].values.round(2)
+    return df
+
+
+def tooltip_odds(df):
+    # open odds for the tooltips, rounded so float32 storage doesn't leak into the text
+    return df[OPEN_ODDS_COLS].apply(pd.to_numeric, errors='coerce').astype('float64').round(2)
+
+
+@metrics.timed('league_odds_tab', kind='view', rows=table_rows)
+def league_odds_tab(country, league, true_odds=False):
+    df = STORE.league_matches(country, league)
+    df = df.reset_index()
+    if true_odds:
+        df = with_true_odds(df)
+    # match date with the embedded match link
+    df['match_dt'] = df['date_link']
+
+    # conver odds to float with 2 decimal and add odds change direction symbol
+    df[ODDS_COLS] = format_odds(df)
+    
+    cols = ['match_dt','home_name', 'away_name', 'home_odds', 'draw_odds', 'away_odds', 'total', 'handicap']
+    df[OPEN_ODDS_COLS] = tooltip_odds(df)
+    tooltip_data = [
+        {f'{side}_odds': str(row[f'{side}_open_odds']) for side in ['home', 'draw', 'away']}
+        for row in df[OPEN_ODDS_COLS].to_dict('records')
+    ]
+
+    return df[cols].to_dict('records'), tooltip_data, LEAGUE_STYLE
+
+
+def page_slice(page):
+    # (start, stop) rows of a table page, the whole table when page is None
+    if page is None:
+        return None, None
+    return page * PAGE_SIZE, (page + 1) * PAGE_SIZE
+
+
+def page_count(rows):
+    return max(1, -(-rows // PAGE_SIZE))
+
+
+@metrics.timed('team_odds_tab', kind='view', rows=table_rows)
+def team_odds_tab(match_link, side, true_odds=False, page=None):
+    team_id = STORE.match(match_link)[f'{side}_id']
+
+    df = STORE.team_matches(team_id, *page_slice(page))
+    df = df.reset_index()
+    if true_odds:
+        df = with_true_odds(df)
+    # match date with the embedded match link
+    df['match_dt'] = df['date_link']
+
+    df['result'] = '' # empty col to color cell according to match result  win, draw, loss | green, yellow, red
+
+    # conver odds to float with 2 decimal and add odds change direction symbol
+    df[ODDS_COLS] = format_odds(df)
+
+    cols = ['result', 'match_dt', 'final_score', 'home_name', 'away_name', 'league', 'home_odds',
+            'draw_odds', 'away_odds', 'total']
+    df[OPEN_ODDS_COLS] = tooltip_odds(df)
+    tooltip_data = []
+    for row in df[OPEN_ODDS_COLS + ['handicap']].to_dict('records'):
+        tooltip = {f'{side}_odds': str(row[f'{side}_open_odds']) for side in ['home', 'draw', 'away']}
+        tooltip['home_odds'] = tooltip['home_odds'] + ' | ' + str(row['handicap'])
+        tooltip_data.append(tooltip)
+
+    # hidden columns the style rules are evaluated against
+    df['selected'] = (df['match_link'] == match_link).astype(int)
+    df['home_team'] = (df['home_id'] == team_id).astype(int)
+    df['away_team'] = (df['away_id'] == team_id).astype(int)
+    df['pinnacle'] = (df['pinnacle'] == True).astype(int)
+    won = ((df['match_outcome'] == 'home') & (df['home_team'] == 1)) | ((df['match_outcome'] == 'away') & (df['away_team'] == 1))
+    df['team_result'] = np.select([won, df['match_outcome'] == 'draw', df['match_outcome'].notna()], ['win', 'draw', 'loss'], '')
+    df['match_outcome'] = df['match_outcome'].astype(object).where(df['match_outcome'].notna(), None)
+
+    return df[cols + MATCH_STYLE_COLS + ['team_result']].to_dict('records'), tooltip_data, TEAM_STYLE
+
+
+def form_summary(match_link, side):
+    # recent form of one side of the match in a line, read from the materialized forms
+    recent = form.team_form(STORE.match(match_link)[f'{side}_id'])
+    if recent is None:
+        return ''
+    avg_odds = '-' if np.isnan(recent.avg_odds) else f'{recent.avg_odds:.2f}'
+    beat_open = '-' if np.isnan(recent.beat_open) else f'{recent.beat_open:.0%}'
+    return (
+        f'Last {recent.matches}: {recent.results} | {recent.points} pts | '
+        f'goals {recent.goals_for:.0f}:{recent.goals_against:.0f} | avg odds {avg_odds} | beat open odds {beat_open}'
+    )
+
+
+def odds_movement(match_link):
+    # line movement chart of the match odds, decoded from the match's own history only
+    history = odds_history.HISTORY.read(match_link)
+    # matches without recorded ticks come as an empty object frame
+    ts = pd.to_datetime(history['ts']).dt.strftime('%Y-%m-%d %H:%M').tolist()
+    lines = [
+        {'x': ts, 'y': history[col].astype(object).where(history[col].notna(), None).tolist(),
+         'name': col.split('_')[0].capitalize(), 'mode': 'lines+markers', 'line': {'shape': 'hv'}}
+        for col in ODDS_COLS
+    ]
+    layout = {
+        'height': 260,
+        'margin': {'l': 40, 'r': 10, 't': 10, 'b': 30},
+        'yaxis': {'type': 'log'},
+        'legend': {'orientation': 'h'},
+    }
+    return {'data': lines, 'layout': layout}
+
+
+@metrics.timed('create_h2h_tab', kind='view', rows=table_rows)
+def create_h2h_tab(match_link, true_odds=False, page=None):
+    teams_ids = STORE.match(match_link)[['home_id', 'away_id']].values.tolist()
+
+    # direct meetings first, then the last meetings with each common opponent, blocks split by an empty row.
+    # lines holds the row of every table line in the concatenated blocks, -1 for a separator
+    blocks = STORE.h2h_matches(*teams_ids)
+    sizes = [len(matches) for matches in blocks]
+    offsets = np.cumsum([0] + sizes[:-1])
+    lines = np.concatenate([np.append(np.arange(size) + offset, -1) for size, offset in zip(sizes, offsets)])
+    total_rows = len(lines) # for the page count, the blocks are only built here
+    start, stop = page_slice(page)
+    lines = lines[start:stop]
+    # blocks share their categories, only the rows of the page are taken
+    df = pd.concat(blocks, ignore_index=True).iloc[lines[lines >= 0]].reset_index(drop=True)
+    if true_odds:
+        df = with_true_odds(df)
+
+    # match date with the embedded match link
+    df['match_dt'] = df['date_link']
+
+    df['result'] = '' # empty col to color cell according to match result  win, draw, loss | green, yellow, red
+
+    # conver odds to float with 2 decimal and add odds change direction symbol
+    df[ODDS_COLS] = format_odds(df)
+
+    cols = ['match_dt', 'final_score', 'home_name', 'away_name', 'league', 'home_odds',
+            'draw_odds', 'away_odds', 'total']
+    df[OPEN_ODDS_COLS] = tooltip_odds(df)
+    tooltip_data = []
+    for row in df[OPEN_ODDS_COLS + ['handicap']].to_dict('records'):
+        tooltip = {f'{side}_odds': str(row[f'{side}_open_odds']) for side in ['home', 'draw', 'away']}
+        tooltip['home_odds'] = tooltip['home_odds'] + ' | ' + str(row['handicap'])
+        tooltip_data.append(tooltip)
+
+    # hidden columns the style rules are evaluated against
+    df['selected'] = (df['match_link'] == match_link).astype(int)
+    df['home_team'] = df['home_id'].isin(teams_ids).astype(int)
+    df['away_team'] = df['away_id'].isin(teams_ids).astype(int)
+    df['pinnacle'] = (df['pinnacle'] == True).astype(int)
+    df['separator'] = 0
+
+    out_cols = cols + MATCH_STYLE_COLS + ['separator']
+    records = df[out_cols].astype(object).fillna('').to_dict('records')
+    separator = dict.fromkeys(out_cols, '')
+    separator.update(selected=0, home_team=0, away_team=0, pinnacle=0, separator=1)
+    empty_tooltip = {f'{side}_odds': None for side in ['home', 'draw', 'away']}
+
+    # separator rows go in between the formatted rows
+    rows, row_tooltips = iter(records), iter(tooltip_data)
+    data, tooltips = [], []
+    for line in lines:
+        data.append(dict(separator) if line < 0 else next(rows))
+        tooltips.append(empty_tooltip if line < 0 else next(row_tooltips))
+    return data, tooltips, H2H_STYLE, total_rows
+
+
+@metrics.timed('backtest_tab', kind='view', rows=table_rows)
+def backtest_tab(country, preset):
+    # backtest preset over the finished matches of the country, per league and season
+    _, rule, params = backtest.PRESETS[preset]
+    leagues = [STORE.league_matches(country, league, finished=True) for league in STORE.leagues(country)]
+    placed = backtest.run(pd.concat(leagues, ignore_index=True), rule, params, workers=1) if leagues else None
+    if placed is None or placed.empty:
+        return [], BACKTEST_STYLE
+
+    df = pd.concat([
+        backtest.summarize(placed, ['league', 'season']),
+        backtest.summarize(placed, ['league']).assign(season='All'),
+    ]).sort_values(['league', 'season'], kind='mergesort')
+    for col in ['hit_rate', 'roi']:
+        df[col] = (df[col] * 100).round(1).astype(str) + '%'
+    return df.to_dict('records'), BACKTEST_STYLE
+
+
+@metrics.timed('scanner_tab', kind='view', rows=table_rows)
+def scanner_tab(pinnacle_only=False):
+    # biggest odds drops against open over the unfinished matches of every country
+    df = scanner.top_drops(pinnacle_only)
+    df = df.assign(
+        country=df['country'].str.capitalize(),
+        match_dt=df['date_link'],
+        open_odds=df['open_odds'].map('{:.2f}'.format),
+        odds=df['odds'].map('{:.2f}'.format),
+        drop='🔻' + (df['drop'] * 100).map('{:.1f}%'.format),
+        pinnacle=df['pinnacle'].astype(int),
+    )
+    cols = ['country', 'league', 'match_dt', 'home_name', 'away_name', 'side', 'open_odds', 'odds', 'drop', 'pinnacle']
+    return df[cols].to_dict('records'), SCANNER_STYLE
+
+
+def cached_league_odds_tab(country, league, true_odds=False):
+    return render_cache.CACHE.get_or_render(
+        ('league', country, league, true_odds), [league_tag(country, league)],
+        league_odds_tab, country, league, true_odds
+    )
+
+
+def cached_team_odds_tab(match_link, side, true_odds=False, page=None):
+    team_id = STORE.match(match_link)[f'{side}_id']
+    return render_cache.CACHE.get_or_render(
+        ('team', match_link, side, true_odds, page), [team_tag(team_id)],
+        team_odds_tab, match_link, side, true_odds, page
+    )
+
+
+def cached_h2h_tab(match_link, true_odds=False, page=None):
+    match = STORE.match(match_link)
+    return render_cache.CACHE.get_or_render(
+        ('h2h', match_link, true_odds, page), [team_tag(match['home_id']), team_tag(match['away_id'])],
+        create_h2h_tab, match_link, true_odds, page
+    )
+
+
+def cached_backtest_tab(country, preset):
+    return render_cache.CACHE.get_or_render(
+        ('backtest', country, preset), [league_tag(country, league) for league in STORE.leagues(country)],
+        backtest_tab, country, preset
+    )
+
+
+def use(source):
+    global STORE, _NAV
+    STORE = source
+    _NAV = None
+
+
+def today():
+    return dt.datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def nav_index():
+    # countries, leagues and upcoming matches of the current data version, the dropdowns
+    # are filtered from it in the browser; built once per version
+    global _NAV
+
+    version = STORE.current().version
+    if _NAV is not None and _NAV['version'] == version:
+        return _NAV
+    countries = STORE.countries()
+    leagues, matches = {}, {}
+    for country in countries:
+        leagues[country] = sorted(STORE.leagues(country), key=lambda s: s[-1])
+        matches[country] = {}
+        for league in leagues[country]:
+            fixtures = STORE.league_matches(country, league)
+            fixtures = fixtures[fixtures['match_dt'] >= today()]
+            matches[country][league] = [
+                [kickoff.strftime('%Y-%m-%d'), kickoff.strftime('%d.%m') + ' | ' + str(match), match_link]
+                for match, kickoff, match_link in zip(fixtures['match'], fixtures['match_dt'], fixtures['match_link'])
+            ]
+    _NAV = {
+        'version': version,
+        'top': TOP_COUNTRIES,
+        'countries': countries,
+        'leagues': leagues,
+        'matches': matches, # country -> league -> [kick-off date, label, match_link]
+    }
+    return _NAV